@@ -13,7 +13,8 @@ setup(
    'Symmetric-key algorithms.',
   long_description =
    'Pure Python implementation of Blowfish and AES ' \
-   'with EBC, CBC and PCBC modes and variable key length support.',
+   'with EBC, CBC, PCBC, CTR, OFB and CFB modes and variable key length support. ' \
+   'Requires Python 2.7.',
   author = michurin,
   author_email = michurin_email,
   maintainer = michurin,
@@ -35,6 +36,7 @@ setup(
     'License :: OSI Approved :: BSD License',
     'Operating System :: OS Independent',
     'Programming Language :: Python :: 2',
+    'Programming Language :: Python :: 2.7',
     'Topic :: Security :: Cryptography',
     'Topic :: Software Development :: Libraries']
 )
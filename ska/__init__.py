@@ -44,4 +44,9 @@ Medium layer provides convenience shortcuts. See ska.shortcuts.
 Undermost layer gives you access to all parts of
 encryption/decryption operations separately. See source code
 of ska.shortcuts for more details.
+
+Large payloads can be processed by pool of worker
+processes. See ska.parallel.
+
+Performance can be measured by python -m ska.bench (see ska.bench).
 '''
@@ -24,6 +24,13 @@
 # authors and should not be interpreted as representing official policies, either expressed
 # or implied, of Alexey V Michurin.
 
+from struct import Struct
+from binascii import hexlify, unhexlify
+try:
+    import numpy
+except ImportError:
+    # optional, for multi-block engine
+    numpy = None
 
 __all__ = 'aes'
 
@@ -32,6 +39,22 @@ __doc__ = '''AES (Advanced Encryption Standard) implementation
 Block size: 128 bits
 Key size: 128, 192, 256 bits
 
+Encryption and decryption use 32-bit T-tables (see
+encryption_loop_t, decryption_loop_t); byte-oriented
+encryption_loop/decryption_loop are kept as reference
+implementation.
+
+aes.enc_blocks/dec_blocks process a buffer of many independent
+blocks (ECB-like). If NumPy is available, buffers of ARRAY_THRESHOLD
+bytes and more go to aes.enc_array/dec_array: they take an (N, 16)
+uint8 array and do every round for all N blocks by table lookups
+with fancy indexing. Without NumPy, buffers of SLICED_THRESHOLD
+bytes and more go to byte-sliced engine (see encryption_loop_sliced,
+decryption_loop_sliced): every step of a round is done over
+the whole buffer by str.translate, slicing and long integer
+operations. NumPy round keys are cached on the cipher; sliced
+masks and round keys grow with the buffer and are built per call.
+
 Example:
 from ska.aes import aes
 cipher = aes('keykeykeykeykeykeykeykey') # 192 bits
@@ -260,17 +283,302 @@ def str_to_vec(x):
 def vec_to_str(x):
     return ''.join(map(chr, x))
 
+# T-tables engine
+#
+# State is kept as four 32-bit column words. TE0[x] is the column
+# produced by SubBytes and MixColumns from byte x in row 0; TE1..TE3
+# are the same column rotated for rows 1..3. ShiftRows is done by
+# choosing source words, so a round is 16 lookups and 16 XORs.
+# TD0..TD3 do the same for InvSubBytes and InvMixColumns. Decryption
+# uses the equivalent inverse cipher (FIPS-197, 5.3.5): round keys
+# go in reverse order and have InvMixColumns applied beforehand.
+
+def ror8(x):
+    return ((x >> 8) | (x << 24)) & 0xffffffff
+
+def make_enc_tables():
+    te0 = []
+    for s in SBOX:
+        te0.append((gm(s, 2) << 24) | (s << 16) | (s << 8) | gm(s, 3))
+    te1 = map(ror8, te0)
+    te2 = map(ror8, te1)
+    te3 = map(ror8, te2)
+    return te0, te1, te2, te3
+
+TE0, TE1, TE2, TE3 = make_enc_tables()
+
+def make_dec_tables():
+    td0 = []
+    for s in INVSBOX:
+        td0.append((gm(s, 14) << 24) | (gm(s, 9) << 16) | (gm(s, 13) << 8) | gm(s, 11))
+    td1 = map(ror8, td0)
+    td2 = map(ror8, td1)
+    td3 = map(ror8, td2)
+    return td0, td1, td2, td3
+
+TD0, TD1, TD2, TD3 = make_dec_tables()
+
+def key_to_words(ekey):
+    return [(ekey[i] << 24) | (ekey[i+1] << 16) | (ekey[i+2] << 8) | ekey[i+3]
+            for i in xrange(0, len(ekey), 4)]
+
+def inv_mix_word(w): # SBOX cancels INVSBOX built into TD tables
+    sb = SBOX
+    return TD0[sb[w >> 24]] ^ TD1[sb[(w >> 16) & 0xff]] ^ \
+           TD2[sb[(w >> 8) & 0xff]] ^ TD3[sb[w & 0xff]]
+
+def dec_key_words(erk, nr):
+    drk = []
+    for r in xrange(nr * 4, -1, -4):
+        rk = erk[r:r+4]
+        if 0 < r < nr * 4:
+            rk = map(inv_mix_word, rk)
+        drk.extend(rk)
+    return drk
+
+def encryption_loop_t(w, rk, nr):
+    te0 = TE0
+    te1 = TE1
+    te2 = TE2
+    te3 = TE3
+    s0 = w[0] ^ rk[0]
+    s1 = w[1] ^ rk[1]
+    s2 = w[2] ^ rk[2]
+    s3 = w[3] ^ rk[3]
+    for r in xrange(4, nr * 4, 4):
+        t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xff] ^ \
+             te2[(s2 >> 8) & 0xff] ^ te3[s3 & 0xff] ^ rk[r]
+        t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xff] ^ \
+             te2[(s3 >> 8) & 0xff] ^ te3[s0 & 0xff] ^ rk[r+1]
+        t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xff] ^ \
+             te2[(s0 >> 8) & 0xff] ^ te3[s1 & 0xff] ^ rk[r+2]
+        t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xff] ^ \
+             te2[(s1 >> 8) & 0xff] ^ te3[s2 & 0xff] ^ rk[r+3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    # last round: no MixColumns
+    sb = SBOX
+    r = nr * 4
+    return (
+        (sb[s0 >> 24] << 24) ^ (sb[(s1 >> 16) & 0xff] << 16) ^
+        (sb[(s2 >> 8) & 0xff] << 8) ^ sb[s3 & 0xff] ^ rk[r],
+        (sb[s1 >> 24] << 24) ^ (sb[(s2 >> 16) & 0xff] << 16) ^
+        (sb[(s3 >> 8) & 0xff] << 8) ^ sb[s0 & 0xff] ^ rk[r+1],
+        (sb[s2 >> 24] << 24) ^ (sb[(s3 >> 16) & 0xff] << 16) ^
+        (sb[(s0 >> 8) & 0xff] << 8) ^ sb[s1 & 0xff] ^ rk[r+2],
+        (sb[s3 >> 24] << 24) ^ (sb[(s0 >> 16) & 0xff] << 16) ^
+        (sb[(s1 >> 8) & 0xff] << 8) ^ sb[s2 & 0xff] ^ rk[r+3])
+
+def decryption_loop_t(w, rk, nr): # rk from dec_key_words
+    td0 = TD0
+    td1 = TD1
+    td2 = TD2
+    td3 = TD3
+    s0 = w[0] ^ rk[0]
+    s1 = w[1] ^ rk[1]
+    s2 = w[2] ^ rk[2]
+    s3 = w[3] ^ rk[3]
+    for r in xrange(4, nr * 4, 4):
+        t0 = td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xff] ^ \
+             td2[(s2 >> 8) & 0xff] ^ td3[s1 & 0xff] ^ rk[r]
+        t1 = td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xff] ^ \
+             td2[(s3 >> 8) & 0xff] ^ td3[s2 & 0xff] ^ rk[r+1]
+        t2 = td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xff] ^ \
+             td2[(s0 >> 8) & 0xff] ^ td3[s3 & 0xff] ^ rk[r+2]
+        t3 = td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xff] ^ \
+             td2[(s1 >> 8) & 0xff] ^ td3[s0 & 0xff] ^ rk[r+3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    # last round: no InvMixColumns
+    sb = INVSBOX
+    r = nr * 4
+    return (
+        (sb[s0 >> 24] << 24) ^ (sb[(s3 >> 16) & 0xff] << 16) ^
+        (sb[(s2 >> 8) & 0xff] << 8) ^ sb[s1 & 0xff] ^ rk[r],
+        (sb[s1 >> 24] << 24) ^ (sb[(s0 >> 16) & 0xff] << 16) ^
+        (sb[(s3 >> 8) & 0xff] << 8) ^ sb[s2 & 0xff] ^ rk[r+1],
+        (sb[s2 >> 24] << 24) ^ (sb[(s1 >> 16) & 0xff] << 16) ^
+        (sb[(s0 >> 8) & 0xff] << 8) ^ sb[s3 & 0xff] ^ rk[r+2],
+        (sb[s3 >> 24] << 24) ^ (sb[(s2 >> 16) & 0xff] << 16) ^
+        (sb[(s1 >> 8) & 0xff] << 8) ^ sb[s0 & 0xff] ^ rk[r+3])
+
+# NumPy engine: T-tables engine for N blocks at once
+#
+# State is a (4, N) array of column words, row i holds column i
+# of every block. Round keys are (nr + 1, 4, 1) arrays to be
+# broadcast over all blocks.
+
+if numpy is not None:
+    NTE = [numpy.array(t, numpy.uint32) for t in (TE0, TE1, TE2, TE3)]
+    NTD = [numpy.array(t, numpy.uint32) for t in (TD0, TD1, TD2, TD3)]
+    NSBOX = numpy.array(SBOX, numpy.uint32)
+    NINVSBOX = numpy.array(INVSBOX, numpy.uint32)
+
+def array_round_keys(rk, nr):
+    return numpy.array(rk, numpy.uint32).reshape(nr + 1, 4, 1)
+
+def array_loop(blocks, rk, nr, tables, sbox, shifts):
+    # shifts: columns feeding rows 1..3, (1, 2, 3) for ShiftRows,
+    # (3, 2, 1) for InvShiftRows
+    n = blocks.shape[0]
+    words = numpy.ascontiguousarray(blocks, numpy.uint8).view('>u4')
+    s = words.T.astype(numpy.uint32) ^ rk[0]
+    t = numpy.empty_like(s)
+    t0, t1, t2, t3 = tables
+    a, b, c = shifts
+    for r in xrange(1, nr):
+        for i in xrange(4):
+            t[i] = t0[s[i] >> 24] ^ t1[(s[(i+a)%4] >> 16) & 0xff] ^ \
+                   t2[(s[(i+b)%4] >> 8) & 0xff] ^ t3[s[(i+c)%4] & 0xff]
+        t ^= rk[r]
+        s, t = t, s
+    for i in xrange(4):
+        t[i] = (sbox[s[i] >> 24] << 24) ^ (sbox[(s[(i+a)%4] >> 16) & 0xff] << 16) ^ \
+               (sbox[(s[(i+b)%4] >> 8) & 0xff] << 8) ^ sbox[s[(i+c)%4] & 0xff]
+    t ^= rk[nr]
+    return t.T.astype('>u4').view(numpy.uint8).reshape(n, 16)
+
+def encryption_loop_np(blocks, rk, nr): # rk from array_round_keys
+    return array_loop(blocks, rk, nr, NTE, NSBOX, (1, 2, 3))
+
+def decryption_loop_np(blocks, rk, nr): # rk from array_round_keys(drk)
+    return array_loop(blocks, rk, nr, NTD, NINVSBOX, (3, 2, 1))
+
+# Byte-sliced engine: pure Python, N blocks at once
+#
+# State of all blocks is one long integer (big-endian, block after
+# block). SubBytes is str.translate, ShiftRows is 16 extended slice
+# assignments (bytearray), AddRoundKey is XOR with the round key
+# repeated N times. MixColumns works on every column word of every
+# block together: with rot1/rot2 rotating each word by 1/2 bytes,
+# u = x ^ rot1(x) gives a0^a1 and so on, and
+# MixColumns(x) = x ^ u ^ rot2(u) ^ xtime(u)
+# InvMixColumns(x) = MixColumns(x ^ xtime(xtime(x ^ rot2(x))))
+# xtime of every byte is masking, shift and multiplication
+# of high bits by 0x1b (products do not overlap).
+
+SBOX_STR = vec_to_str(SBOX)
+INVSBOX_STR = vec_to_str(INVSBOX)
+
+# byte p of state (column p/4, row p%4) comes from byte SHIFT_ROWS[p]
+SHIFT_ROWS = [4 * ((p // 4 + p % 4) % 4) + p % 4 for p in xrange(16)]
+INV_SHIFT_ROWS = [4 * ((p // 4 - p % 4) % 4) + p % 4 for p in xrange(16)]
+
+def repeat_long(pattern, n):
+    return long(hexlify(pattern * n), 16)
+
+def long_to_str(x, size):
+    return unhexlify('%0*x' % (size * 2, x))
+
+def sliced_masks(n):
+    return tuple(repeat_long(p, n) for p in (
+        '\xff\xff\xff\x00' * 4, '\x00\x00\x00\xff' * 4, # rot1
+        '\xff\xff\x00\x00' * 4, '\x00\x00\xff\xff' * 4, # rot2
+        '\x7f' * 16, '\x80' * 16))                         # xtime
+
+def sliced_round_keys(ekey, nr, n):
+    k = vec_to_str(ekey)
+    return [repeat_long(k[r:r+16], n) for r in xrange(0, 16 * (nr + 1), 16)]
+
+def sliced_mix(x, masks):
+    hi3, lo1, hi2, lo2, lo7, hi1 = masks
+    u = x ^ ((x << 8) & hi3) ^ ((x >> 24) & lo1)
+    return x ^ u ^ ((u << 16) & hi2) ^ ((u >> 16) & lo2) ^ \
+           ((u & lo7) << 1) ^ (((u & hi1) >> 7) * 0x1b)
+
+def sliced_inv_mix(x, masks):
+    hi3, lo1, hi2, lo2, lo7, hi1 = masks
+    v = x ^ ((x << 16) & hi2) ^ ((x >> 16) & lo2)
+    v = ((v & lo7) << 1) ^ (((v & hi1) >> 7) * 0x1b)
+    v = ((v & lo7) << 1) ^ (((v & hi1) >> 7) * 0x1b)
+    return sliced_mix(x ^ v, masks)
+
+def sliced_sub_shift(x, size, sbox, shift, buf):
+    s = long_to_str(x, size).translate(sbox)
+    for p in xrange(16):
+        buf[p::16] = s[shift[p]::16]
+    return long(hexlify(buf), 16)
+
+def encryption_loop_sliced(text, masks, rk, nr): # masks, rk for len(text) // 16 blocks
+    size = len(text)
+    buf = bytearray(size)
+    x = long(hexlify(text), 16) ^ rk[0]
+    for r in xrange(1, nr):
+        x = sliced_mix(sliced_sub_shift(x, size, SBOX_STR, SHIFT_ROWS, buf), masks) ^ rk[r]
+    x = sliced_sub_shift(x, size, SBOX_STR, SHIFT_ROWS, buf) ^ rk[nr]
+    return long_to_str(x, size)
+
+def decryption_loop_sliced(cryp, masks, rk, nr): # straight inverse cipher
+    size = len(cryp)
+    buf = bytearray(size)
+    x = long(hexlify(cryp), 16) ^ rk[nr]
+    for r in xrange(nr - 1, 0, -1):
+        x = sliced_inv_mix(sliced_sub_shift(x, size, INVSBOX_STR, INV_SHIFT_ROWS, buf) ^ rk[r], masks)
+    x = sliced_sub_shift(x, size, INVSBOX_STR, INV_SHIFT_ROWS, buf) ^ rk[0]
+    return long_to_str(x, size)
+
+BLOCK = Struct('>4I') # text <-> four column words
+
+ARRAY_THRESHOLD = 2048 # smaller buffers are faster block by block
+SLICED_THRESHOLD = 1024
+
 
 class aes:
 
     def __init__(self, key):
         self.ekey, self.nr = expand_key(str_to_vec(key))
+        self.erk = key_to_words(self.ekey)
+        self.drk = dec_key_words(self.erk, self.nr)
+        self.__arrays = None # built on first use of enc_array/dec_array
 
     def enc(self, text):
-        return vec_to_str(encryption_loop(str_to_vec(text), self.ekey, self.nr))
+        return BLOCK.pack(*encryption_loop_t(BLOCK.unpack(text), self.erk, self.nr))
 
     def dec(self, cryp):
-        return vec_to_str(decryption_loop(str_to_vec(cryp), self.ekey, self.nr))
+        return BLOCK.pack(*decryption_loop_t(BLOCK.unpack(cryp), self.drk, self.nr))
+
+    def enc_blocks(self, text): # len(text) % 16 == 0
+        if numpy is not None and len(text) >= ARRAY_THRESHOLD:
+            return self.enc_array(numpy.frombuffer(text, numpy.uint8).reshape(-1, 16)).tostring()
+        if numpy is None and len(text) >= SLICED_THRESHOLD:
+            n = len(text) // 16 # masks and keys grow with buffer: not kept
+            return encryption_loop_sliced(text, sliced_masks(n),
+                                          sliced_round_keys(self.ekey, self.nr, n), self.nr)
+        pack = BLOCK.pack
+        unpack_from = BLOCK.unpack_from
+        rk = self.erk
+        nr = self.nr
+        return ''.join([pack(*encryption_loop_t(unpack_from(text, s), rk, nr))
+                        for s in xrange(0, len(text), 16)])
+
+    def dec_blocks(self, cryp):
+        if numpy is not None and len(cryp) >= ARRAY_THRESHOLD:
+            return self.dec_array(numpy.frombuffer(cryp, numpy.uint8).reshape(-1, 16)).tostring()
+        if numpy is None and len(cryp) >= SLICED_THRESHOLD:
+            n = len(cryp) // 16
+            return decryption_loop_sliced(cryp, sliced_masks(n),
+                                          sliced_round_keys(self.ekey, self.nr, n), self.nr)
+        pack = BLOCK.pack
+        unpack_from = BLOCK.unpack_from
+        rk = self.drk
+        nr = self.nr
+        return ''.join([pack(*decryption_loop_t(unpack_from(cryp, s), rk, nr))
+                        for s in xrange(0, len(cryp), 16)])
+
+    if numpy is not None:
+
+        def __get_arrays(self):
+            if self.__arrays is None:
+                self.__arrays = (array_round_keys(self.erk, self.nr),
+                                 array_round_keys(self.drk, self.nr))
+            return self.__arrays
+
+        def arrays_size(self): # bytes, whether arrays are built or not
+            return 2 * (self.nr + 1) * 4 * 4
+
+        def enc_array(self, blocks): # (N, 16) uint8 array
+            return encryption_loop_np(blocks, self.__get_arrays()[0], self.nr)
+
+        def dec_array(self, blocks):
+            return decryption_loop_np(blocks, self.__get_arrays()[1], self.nr)
 
 
 if __name__ == '__main__':
@@ -316,3 +624,80 @@ if __name__ == '__main__':
             print qrepr(cryp), ok(cc == cryp)
             tt = c.dec(cc)
             print qrepr(tt), ok(tt == text)
+    print 'byte-sliced engine'
+    text = ''.join(map(chr, range(256))) * 8
+    for key in '\x01' * 16, '\x02' * 24, '\x03' * 32:
+        c = aes(key)
+        ref = ''.join([c.enc(text[s:s+16]) for s in xrange(0, len(text), 16)])
+        masks = sliced_masks(len(text) // 16)
+        rk = sliced_round_keys(c.ekey, c.nr, len(text) // 16)
+        cryp = encryption_loop_sliced(text, masks, rk, c.nr)
+        print 'key_len = %d bit' % (len(key) * 8), \
+              'enc:', ok(cryp == ref), \
+              'dec:', ok(decryption_loop_sliced(cryp, masks, rk, c.nr) == text), \
+              'blocks:', ok(c.enc_blocks(text) == ref and c.dec_blocks(ref) == text)
+    print 'engines on the same input (NumPy: %s)' % (numpy is not None and 'yes' or 'no')
+    data = ''.join(map(chr, range(256))) * 16
+    for key in '\x05' * 16, '\x06' * 32:
+        c = aes(key)
+        for n in 64, SLICED_THRESHOLD + 576, ARRAY_THRESHOLD + 2048:
+            t = data[:n]
+            ref = ''.join([c.enc(t[s:s+16]) for s in xrange(0, n, 16)])
+            masks = sliced_masks(n // 16)
+            rk = sliced_round_keys(c.ekey, c.nr, n // 16)
+            r = [encryption_loop_sliced(t, masks, rk, c.nr) == ref,
+                 decryption_loop_sliced(ref, masks, rk, c.nr) == t,
+                 c.enc_blocks(t) == ref, c.dec_blocks(ref) == t]
+            if numpy is not None:
+                blocks = numpy.frombuffer(t, numpy.uint8).reshape(-1, 16)
+                r.append(c.enc_array(blocks).tostring() == ref)
+                r.append(c.dec_array(numpy.frombuffer(ref, numpy.uint8).reshape(-1, 16)).tostring() == t)
+            print 'key_len = %d bit, %d bytes' % (len(key) * 8, n), ok(all(r))
+    from threading import Thread
+    c = aes('\x04' * 16) # shared by threads, as in ska.cache
+    sizes = 16, 1024, 1056, 2048, 3072
+    text = text * 2
+    refs = dict((n, ''.join([c.enc(text[s:s+16]) for s in xrange(0, n, 16)])) for n in sizes)
+    errors = []
+    def worker(k):
+        try:
+            for i in xrange(20):
+                n = sizes[(i + k) % len(sizes)]
+                if c.enc_blocks(text[:n]) != refs[n] or c.dec_blocks(refs[n]) != text[:n]:
+                    errors.append(n)
+        except Exception, e:
+            errors.append(e)
+    threads = [Thread(target=worker, args=(k,)) for k in xrange(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print 'threads, mixed sizes', ok(not errors)
+    # benchmark
+    from time import time
+    c = aes('\x00' * 16)
+    text = '\x00' * 16
+    tvec = str_to_vec(text)
+    n = 2000
+    for name, op in (
+        ('encryption_loop  ', lambda: encryption_loop(tvec, c.ekey, c.nr)),
+        ('decryption_loop  ', lambda: decryption_loop(tvec, c.ekey, c.nr)),
+        ('encryption_loop_t', lambda: c.enc(text)),
+        ('decryption_loop_t', lambda: c.dec(text))):
+        t = time()
+        for _ in xrange(n):
+            op()
+        t = time() - t
+        print '%s %10.0f blocks/sec' % (name, n / t)
+    text = '\x00' * 65536
+    n = 10
+    masks = sliced_masks(len(text) // 16)
+    rk = sliced_round_keys(c.ekey, c.nr, len(text) // 16)
+    for name, op in (
+        ('encryption_loop_sliced', lambda: encryption_loop_sliced(text, masks, rk, c.nr)),
+        ('decryption_loop_sliced', lambda: decryption_loop_sliced(text, masks, rk, c.nr))):
+        t = time()
+        for _ in xrange(n):
+            op()
+        t = time() - t
+        print '%s %5.0f blocks/sec' % (name, n * len(text) / 16 / t)
@@ -0,0 +1,301 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+import os
+import sys
+import json
+import platform
+from time import time, strftime
+from optparse import OptionParser
+from traceback import format_exc
+try:
+    import resource
+except ImportError:
+    # not Unix
+    resource = None
+
+from bf import blowfish
+from aes import aes
+from mode import enc_ecb, dec_ecb, enc_cbc, dec_cbc, enc_pcbc, dec_pcbc
+from key import passphrase_to_salted_key_and_iv, pbkdf2_sha256, pbkdf2_sha256_python
+
+__all__ = 'run', 'compare', 'main'
+
+__doc__ = '''Benchmarks
+
+Measures for every cipher and key size:
+ - key derivation latency (OpenSSL EVP_BytesToKey) and PBKDF2
+   iterations per second (hashlib.pbkdf2_hmac, if available,
+   and pure Python implementation),
+ - key schedule latency,
+ - single block encryption/decryption latency,
+ - bulk throughput for ECB, CBC, PCBC and given payload sizes,
+   and peak memory growth for payloads of RSS_MIN_SIZE and more
+   (smaller ones fit in memory the interpreter already holds).
+
+Usage:
+python -m ska.bench -o results.json
+python -m ska.bench -b baseline.json --sizes 16,1K,1M,64M
+
+Results are saved as JSON: {"meta": {...}, "results": {name:
+{"value": number, "unit": "s"|"B/s"|"it/s"|"KB"}}}. Given a baseline
+file, results are compared with it: for "s" and "KB" lower is
+better, for "B/s" and "it/s" higher is better.
+'''
+
+BF_KEYLENS = range(4, 57, 4)
+AES_KEYLENS = 16, 24, 32
+RSS_MIN_SIZE = 1 << 18
+DEFAULT_SIZES = '16,1K,64K'
+KDF_ITERATIONS = 1000
+
+MODES = {
+    'ecb': (lambda bc, iv: enc_ecb(bc, len(iv)), lambda bc, iv: dec_ecb(bc, len(iv))),
+    'cbc': (enc_cbc, dec_cbc),
+    'pcbc': (enc_pcbc, dec_pcbc)}
+
+def ciphers(names, keylens=None):
+    '''Yield (name, cipher class, block size, key length)'''
+    if 'bf' in names:
+        for k in keylens or BF_KEYLENS:
+            if k in BF_KEYLENS:
+                yield 'bf-%d' % (k * 8), blowfish, 8, k
+    if 'aes' in names:
+        for k in keylens or AES_KEYLENS:
+            if k in AES_KEYLENS:
+                yield 'aes-%d' % (k * 8), aes, 16, k
+
+def parse_size(s):
+    s = s.strip().upper()
+    m = 1
+    if s[-1:] in ('K', 'M', 'G'):
+        m = 1 << {'K': 10, 'M': 20, 'G': 30}[s[-1]]
+        s = s[:-1]
+    return int(s) * m
+
+def measure(func, min_time=0.2, repeat=3):
+    '''Best time of one func() call, seconds'''
+    n = 1
+    while True:
+        t = time()
+        for _ in xrange(n):
+            func()
+        t = time() - t
+        if t >= min_time / repeat:
+            break
+        n = n * 2
+    best = t / n
+    for _ in xrange(repeat - 1):
+        t = time()
+        for _ in xrange(n):
+            func()
+        best = min(best, (time() - t) / n)
+    return best
+
+def maxrss():
+    '''Peak resident set size of current process, KB'''
+    if resource is None:
+        return 0
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        r //= 1024 # bytes on Mac OS X
+    return r
+
+def isolated(func):
+    '''Run func() in forked process if possible;
+    return (result, growth of peak RSS in KB while func() runs)
+
+    Exception in child is reraised in parent as RuntimeError.
+    '''
+    if not hasattr(os, 'fork'):
+        base = maxrss()
+        r = func()
+        return r, maxrss() - base
+    rd, wr = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(rd)
+            base = maxrss()
+            try:
+                out = [func(), maxrss() - base]
+            except Exception:
+                out = {'error': format_exc()}
+            else:
+                status = 0
+            os.write(wr, json.dumps(out))
+        finally:
+            os._exit(status)
+    os.close(wr)
+    data = []
+    while True:
+        d = os.read(rd, 4096)
+        if not d:
+            break
+        data.append(d)
+    os.close(rd)
+    status = os.waitpid(pid, 0)[1]
+    try:
+        out = json.loads(''.join(data))
+    except ValueError:
+        out = {'error': 'no result'}
+    if isinstance(out, dict):
+        raise RuntimeError('benchmark failed in child (exit status %d):\n%s' %
+                           (os.WEXITSTATUS(status), out['error']))
+    return tuple(out)
+
+def bench_kdf(name, bc, bs, klen, opts):
+    yield name + '/kdf/md5', measure(
+        lambda: passphrase_to_salted_key_and_iv('passphrase', 'saltsalt', klen, bs),
+        opts.min_time), 's'
+    for kdf, func in ('pbkdf2', pbkdf2_sha256), ('pbkdf2-python', pbkdf2_sha256_python):
+        t = measure(lambda: func('passphrase', 'saltsalt', KDF_ITERATIONS, klen + bs),
+                    opts.min_time)
+        yield name + '/kdf/' + kdf, KDF_ITERATIONS / t, 'it/s'
+
+def bench_keysetup(name, bc, bs, klen, opts):
+    key = '\x5a' * klen
+    yield name + '/key_schedule', measure(lambda: bc(key), opts.min_time), 's'
+
+def bench_block(name, bc, bs, klen, opts):
+    c = bc('\x5a' * klen)
+    block = '\xa5' * bs
+    yield name + '/block/enc', measure(lambda: c.enc(block), opts.min_time), 's'
+    yield name + '/block/dec', measure(lambda: c.dec(block), opts.min_time), 's'
+
+def bench_bulk(name, bc, bs, klen, opts):
+    c = bc('\x5a' * klen)
+    iv = '\xa5' * bs
+    for mode in opts.modes:
+        enc_mode, dec_mode = MODES[mode]
+        for size in opts.sizes:
+            size -= size % bs
+            for op, mode_class in ('enc', enc_mode), ('dec', dec_mode):
+                def run():
+                    text = '\0' * size
+                    return size / measure(lambda: mode_class(c, iv)(text),
+                                          opts.min_time, 1)
+                throughput, rss = isolated(run)
+                case = '%s-%s/%s/%d' % (name, mode, op, size)
+                yield case, throughput, 'B/s'
+                if size >= RSS_MIN_SIZE:
+                    yield case + '/peak_rss', rss, 'KB'
+
+SUITES = {
+    'kdf': bench_kdf,
+    'keysetup': bench_keysetup,
+    'block': bench_block,
+    'bulk': bench_bulk}
+
+SUITES_ORDER = 'kdf', 'keysetup', 'block', 'bulk'
+
+def run(opts, out=sys.stdout):
+    '''Run suites, return results dict'''
+    results = {}
+    for suite in opts.suites:
+        for cipher in ciphers(opts.ciphers, opts.keylens):
+            for case, value, unit in SUITES[suite](*cipher + (opts,)):
+                results[case] = {'value': value, 'unit': unit}
+                out.write('%-40s %14.6g %s\n' % (case, value, unit))
+                out.flush()
+    return results
+
+def compare(results, baseline, tolerance=0.05, out=sys.stdout):
+    '''Print comparison, return number of regressions'''
+    regressions = 0
+    for case in sorted(results):
+        if case not in baseline:
+            continue
+        v = results[case]['value']
+        b = baseline[case]['value']
+        if not b or not v:
+            continue
+        if results[case]['unit'] in ('B/s', 'it/s'):
+            gain = v / float(b) - 1
+        else:
+            gain = b / float(v) - 1
+        verdict = ''
+        if gain > tolerance:
+            verdict = 'better'
+        elif gain < -tolerance:
+            verdict = 'WORSE'
+            regressions += 1
+        out.write('%-40s %12.6g %12.6g %+7.1f%% %s\n' % (
+            case, b, v, gain * 100, verdict))
+    return regressions
+
+def main(argv=None):
+    p = OptionParser(usage='python -m ska.bench [options]')
+    p.add_option('-o', '--output', help='save results to JSON file')
+    p.add_option('-b', '--baseline', help='compare with results from JSON file')
+    p.add_option('--suites', default=','.join(SUITES_ORDER),
+                 help='comma separated, default: %default')
+    p.add_option('--ciphers', default='bf,aes',
+                 help='comma separated, default: %default')
+    p.add_option('--keylens', default='',
+                 help='key lengths in bytes, comma separated, default: all')
+    p.add_option('--modes', default='ecb,cbc,pcbc',
+                 help='comma separated, default: %default')
+    p.add_option('--sizes', default=DEFAULT_SIZES,
+                 help='payload sizes, K and M suffixes allowed, default: %default')
+    p.add_option('--min-time', type='float', default=0.2,
+                 help='minimal time of measurement, seconds, default: %default')
+    p.add_option('--tolerance', type='float', default=0.05,
+                 help='relative change to report, default: %default')
+    opts, args = p.parse_args(argv)
+    opts.suites = opts.suites.split(',')
+    opts.ciphers = opts.ciphers.split(',')
+    opts.keylens = [int(k) for k in opts.keylens.split(',') if k]
+    opts.modes = opts.modes.split(',')
+    opts.sizes = map(parse_size, opts.sizes.split(','))
+    for suite in opts.suites:
+        if suite not in SUITES:
+            p.error('unknown suite %r' % suite)
+    for mode in opts.modes:
+        if mode not in MODES:
+            p.error('unknown mode %r' % mode)
+    results = run(opts)
+    if opts.output:
+        f = open(opts.output, 'w')
+        json.dump({'meta': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'time': strftime('%Y-%m-%d %H:%M:%S')},
+                   'results': results}, f, indent=1, sort_keys=True)
+        f.close()
+    if opts.baseline:
+        f = open(opts.baseline)
+        baseline = json.load(f)['results']
+        f.close()
+        print
+        print '%-40s %12s %12s %8s' % ('case', 'baseline', 'current', 'gain')
+        if compare(results, baseline, opts.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,6 +24,13 @@
 # authors and should not be interpreted as representing official policies, either expressed
 # or implied, of Alexey V Michurin.
 
+from struct import Struct
+try:
+    import numpy
+except ImportError:
+    # optional, for multi-block engine
+    numpy = None
+
 __all__ = 'blowfish'
 
 __doc__ = '''Blowfish implementation
@@ -37,6 +44,11 @@ cipher = blowfish('pass') # 32 bits
 e = cipher.enc('texttext') # 64 bits
 d = cipher.dec(e)
 print repr(d)
+
+blowfish.enc_blocks/dec_blocks process a buffer of many
+independent blocks (ECB-like). If NumPy is available, buffers
+of ARRAY_THRESHOLD bytes and more go to blowfish.enc_array/dec_array
+that take an (N, 8) uint8 array.
 '''
 
 # constants
@@ -324,6 +336,59 @@ def cipher(l, r, pb, sb):
                 sb[2][(r >> 8) & 0xff]) + sb[3][r & 0xff]) & 0xffffffff)
     return r ^ pb[-1], l ^ pb[-2]
 
+def encipher(l, r, p, s0, s1, s2, s3):
+    # 16 rounds of cipher() unrolled, S-boxes are passed as locals;
+    # decrypts if p is reversed P-array
+    l ^= p[0]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[1]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[2]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[3]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[4]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[5]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[6]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[7]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[8]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[9]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[10]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[11]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[12]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[13]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    l ^= p[14]
+    r ^= (((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) +
+          s3[l & 0xff]) & 0xffffffff
+    r ^= p[15]
+    l ^= (((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) +
+          s3[r & 0xff]) & 0xffffffff
+    return r ^ p[17], l ^ p[16]
+
 def perpare_boxes(key):
     klen = len(key)
     k = map(ord, key)
@@ -336,18 +401,19 @@ def perpare_boxes(key):
             v += k[i]
             i = (i+1) % klen
         pb.append(x ^ v)
+    sb = [s[:] for s in S_BOXES]
+    s0, s1, s2, s3 = sb
     l = 0
     r = 0
-    for i in xrange(0, len(pb), 2):
-        l, r = cipher (l, r, pb, S_BOXES)
+    for i in xrange(0, 18, 2):
+        l, r = encipher(l, r, pb, s0, s1, s2, s3)
         pb[i] = l
         pb[i + 1] = r
-    sb = map(lambda x: x[:], S_BOXES)
-    for i in xrange(len(sb)):
-        for j in xrange(0, len(sb[i]), 2):
-            l, r = cipher(l, r, pb, sb)
-            sb[i][j] = l
-            sb[i][j + 1] = r
+    for s in sb:
+        for j in xrange(0, 256, 2):
+            l, r = encipher(l, r, pb, s0, s1, s2, s3)
+            s[j] = l
+            s[j + 1] = r
     return pb, sb
 
 # util
@@ -373,6 +439,27 @@ def num_to_text(n):
 def pair_to_text(a, b):
     return num_to_text(a) + num_to_text(b)
 
+BLOCK = Struct('>2I') # text <-> pair of 32-bit words
+
+ARRAY_THRESHOLD = 1024 # smaller buffers are faster block by block
+
+# NumPy engine: N blocks at once, uint32 arithmetic wraps by itself
+
+def array_cipher(blocks, p, s0, s1, s2, s3): # p, s* are uint32 arrays
+    n = blocks.shape[0]
+    w = numpy.ascontiguousarray(blocks, numpy.uint8).view('>u4')
+    l = w[:, 0].astype(numpy.uint32)
+    r = w[:, 1].astype(numpy.uint32)
+    for i in xrange(0, 16, 2):
+        l ^= p[i]
+        r ^= ((s0[l >> 24] + s1[(l >> 16) & 0xff]) ^ s2[(l >> 8) & 0xff]) + s3[l & 0xff]
+        r ^= p[i+1]
+        l ^= ((s0[r >> 24] + s1[(r >> 16) & 0xff]) ^ s2[(r >> 8) & 0xff]) + s3[r & 0xff]
+    out = numpy.empty((n, 2), '>u4')
+    out[:, 0] = r ^ p[17]
+    out[:, 1] = l ^ p[16]
+    return out.view(numpy.uint8).reshape(n, 8)
+
 # interface
 
 class blowfish:
@@ -380,17 +467,51 @@ class blowfish:
     def __init__(self, key):
         self.pb, self.sb = perpare_boxes(key)
         self.rpb = tuple(reversed(self.pb))
-
-    def __cipher(self, pb, text):
-        p, q = text_to_pair(text)
-        a, b = cipher(p, q, pb, self.sb)
-        return pair_to_text(a, b)
+        self.__arrays = None
 
     def enc(self, text):
-        return self.__cipher(self.pb, text)
+        l, r = BLOCK.unpack(text)
+        return BLOCK.pack(*encipher(l, r, self.pb, *self.sb))
 
     def dec(self, text):
-        return self.__cipher(self.rpb, text)
+        l, r = BLOCK.unpack(text)
+        return BLOCK.pack(*encipher(l, r, self.rpb, *self.sb))
+
+    def __blocks(self, pb, text):
+        pack = BLOCK.pack
+        unpack_from = BLOCK.unpack_from
+        s0, s1, s2, s3 = self.sb
+        return ''.join([pack(*encipher(*unpack_from(text, s) + (pb, s0, s1, s2, s3)))
+                        for s in xrange(0, len(text), 8)])
+
+    def enc_blocks(self, text): # len(text) % 8 == 0
+        if numpy is not None and len(text) >= ARRAY_THRESHOLD:
+            return self.enc_array(numpy.frombuffer(text, numpy.uint8).reshape(-1, 8)).tostring()
+        return self.__blocks(self.pb, text)
+
+    def dec_blocks(self, text):
+        if numpy is not None and len(text) >= ARRAY_THRESHOLD:
+            return self.dec_array(numpy.frombuffer(text, numpy.uint8).reshape(-1, 8)).tostring()
+        return self.__blocks(self.rpb, text)
+
+    if numpy is not None:
+
+        def __get_arrays(self): # converted on demand, key setup stays cheap
+            if self.__arrays is None:
+                u32 = lambda x: numpy.array(x, numpy.uint32)
+                self.__arrays = u32(self.pb), u32(self.rpb), map(u32, self.sb)
+            return self.__arrays
+
+        def arrays_size(self): # bytes, whether arrays are built or not
+            return (18 + 18 + 4 * 256) * 4
+
+        def enc_array(self, blocks): # (N, 8) uint8 array
+            pb, rpb, sb = self.__get_arrays()
+            return array_cipher(blocks, pb, *sb)
+
+        def dec_array(self, blocks):
+            pb, rpb, sb = self.__get_arrays()
+            return array_cipher(blocks, rpb, *sb)
 
 # tests
 
@@ -541,3 +662,31 @@ if __name__ == '__main__':
         a, b = cipher(p, q, pb, sb)
         ee = pair_to_text(a, b)
         print qrepr(e), qrepr(ee), ok(e == ee)
+    # Key setup: unrolled encipher() against generic cipher()
+    def perpare_boxes_reference(key):
+        k = map(ord, key)
+        pb = [x ^ (k[(4*i) % len(k)] << 24 | k[(4*i+1) % len(k)] << 16 |
+                   k[(4*i+2) % len(k)] << 8 | k[(4*i+3) % len(k)])
+              for i, x in enumerate(P_BOXES)]
+        l = r = 0
+        for i in xrange(0, len(pb), 2):
+            l, r = cipher(l, r, pb, S_BOXES)
+            pb[i:i+2] = l, r
+        sb = [s[:] for s in S_BOXES]
+        for s in sb:
+            for j in xrange(0, len(s), 2):
+                l, r = cipher(l, r, pb, sb)
+                s[j:j+2] = l, r
+        return pb, sb
+    from time import time
+    for l in xrange(4, 57, 4):
+        k = kk * 3
+        k = k[:l]
+        tr = time()
+        ref = perpare_boxes_reference(k)
+        tr = time() - tr
+        t = time()
+        boxes = perpare_boxes(k)
+        t = time() - t
+        print 'key setup %3d bits: %6.2f ms (generic cipher: %6.2f ms)' % (l * 8, t * 1000, tr * 1000), \
+              ok(boxes == ref)
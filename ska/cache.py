@@ -0,0 +1,132 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from lru import lru
+from key import passphrase_to_salted_key_and_iv, passphrase_to_pbkdf2_key_and_iv
+
+__all__ = 'cipher_cache', 'schedule_size'
+
+__doc__ = '''LRU cache of derived keys and expanded key schedules
+
+Key derivation and key schedule (for Blowfish especially) take
+much more time than encryption of a short message. If the same
+passphrase and salt are used again and again, it makes sense
+to keep ready-to-use ciphers.
+
+Entries are keyed by (algorithm, passphrase, salt, keylen, iterations).
+iterations is None for OpenSSL EVP_BytesToKey (MD5) derivation,
+otherwise number of PBKDF2-HMAC-SHA256 iterations.
+Cache is bounded by number of entries and by estimated number
+of bytes of keys and key schedules.
+
+Example:
+from ska.cache import cipher_cache
+from ska.aes import aes
+cache = cipher_cache(size=16)
+cipher, iv = cache.get(aes, 16, 'passphrase', 'saltsalt', 32)
+print cache.hits, cache.misses
+cache.clear()
+'''
+
+
+def value_size(v):
+    if isinstance(v, str):
+        return len(v)
+    if isinstance(v, (int, long)):
+        return max(4, (v.bit_length() + 7) // 8)
+    if isinstance(v, (list, tuple)):
+        return sum(map(value_size, v))
+    return 0 # NumPy arrays are counted by arrays_size
+
+def schedule_size(block_cipher):
+    '''Rough size of key schedule in bytes (4 bytes per word)
+
+    NumPy form of schedule is built by cipher on demand, it is
+    counted by cipher's arrays_size (if any) without building it.
+    '''
+    arrays_size = getattr(block_cipher, 'arrays_size', None)
+    return sum(map(value_size, vars(block_cipher).values())) + \
+           (arrays_size and arrays_size() or 0)
+
+
+class cipher_cache(lru):
+
+    def __init__(self, size=128, byte_budget=1<<20):
+        lru.__init__(self, size, byte_budget)
+
+    def get(self, block_cipher, block_size, passphrase, salt, keylen, iterations=None):
+        '''Return (cipher, iv); iv length is block_size'''
+        k = (block_cipher, passphrase, salt, keylen, iterations)
+        e = self.lookup(k)
+        if e is not None:
+            return e
+        if iterations is None:
+            key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, block_size)
+        else:
+            key, iv = passphrase_to_pbkdf2_key_and_iv(passphrase, salt, keylen, block_size,
+                                                      iterations)
+        c = block_cipher(key)
+        self.store(k, (c, iv), len(key) + len(iv) + schedule_size(c))
+        return c, iv
+
+    def invalidate(self, passphrase, salt=None):
+        '''Drop all entries for passphrase (and salt, if given)'''
+        self.drop(lambda k: k[1] == passphrase and (salt is None or k[2] == salt))
+
+
+if __name__ == '__main__':
+    from testutil import ok, pad
+    from bf import blowfish
+    from aes import aes
+    b = blowfish('k' * 56)
+    n = schedule_size(b)
+    print pad('schedule size', 50), ok(n == 4 * (18 + 18 + 1024) *
+                                       (hasattr(b, 'arrays_size') and 2 or 1))
+    if hasattr(b, 'enc_array'):
+        b.enc_blocks('x' * 4096) # arrays are built now
+        print pad('schedule size, arrays built', 50), ok(schedule_size(b) == n)
+    cache = cipher_cache(size=2)
+    a, iv = cache.get(blowfish, 8, 'pass', 'saltsalt', 16)
+    b, ivb = cache.get(blowfish, 8, 'pass', 'saltsalt', 16)
+    print pad('hit', 50), ok(a is b and iv == ivb and len(iv) == 8 and
+                             cache.hits == 1 and cache.misses == 1)
+    c, iv = cache.get(aes, 16, 'pass', 'saltsalt', 16)
+    print pad('algorithm in key', 50), ok(c is not a and len(iv) == 16)
+    d, ivd = cache.get(aes, 16, 'pass', 'saltsalt', 16, 1000)
+    print pad('key derivation in key', 50), ok(d is not c and ivd != iv)
+    cache.get(aes, 16, 'pass', 'saltsalt', 32)
+    print pad('size limit', 50), ok(len(cache) == 2 and
+                                    cache.get(blowfish, 8, 'pass', 'saltsalt', 16)[0] is not a)
+    cache.resize(byte_budget=cache.nbytes - 1)
+    print pad('byte budget', 50), ok(len(cache) == 1)
+    cache.invalidate('pass', 'other')
+    print pad('invalidate other salt', 50), ok(len(cache) == 1)
+    cache.invalidate('pass')
+    print pad('invalidate', 50), ok(len(cache) == 0 and cache.nbytes == 0)
+    cache.resize(size=8, byte_budget=1<<20)
+    cache.get(aes, 16, 'pass', 'saltsalt', 16)
+    cache.clear()
+    print pad('clear', 50), ok(len(cache) == 0 and cache.nbytes == 0)
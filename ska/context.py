@@ -0,0 +1,197 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from mode import enc_ecb, dec_ecb, enc_cbc, dec_cbc, enc_pcbc, dec_pcbc, \
+    enc_ctr, dec_ctr, enc_ofb, dec_ofb, enc_cfb, dec_cfb, enc_cfb8, dec_cfb8
+from pad import pkcs5_pad, pkcs5_unpad, pkcs7_pad, pkcs7_unpad
+
+__all__ = 'enc_context', 'dec_context', 'new_context'
+
+__doc__ = '''Incremental (update/finalize) encryption and decryption
+
+enc_context and dec_context wrap mode objects (see ska.mode).
+update(data) takes chunks of any size and returns as much
+result as is ready; finalize() returns the rest.
+
+Block modes (ECB, CBC, PCBC): partial block is kept until next
+update. Encryption pads last block at finalize (PKCS#5 for 64-bit
+blocks, PKCS#7 for 128-bit blocks). Decryption holds back last
+block until finalize to unpad it. padding=False turns padding off,
+then data must be block-aligned by finalize.
+
+Stream modes (CTR, OFB, CFB, CFB8) need no buffering and padding:
+data go through as is.
+
+Example:
+from ska.context import new_context
+from ska.aes import aes
+e = new_context(aes(key), 'cbc', iv)
+cryp = e.update('some') + e.update(' text') + e.finalize()
+d = new_context(aes(key), 'cbc', iv, decrypt=True)
+text = d.update(cryp[:7]) + d.update(cryp[7:]) + d.finalize()
+'''
+
+PADDING = {
+    8: (pkcs5_pad, pkcs5_unpad),
+    16: (pkcs7_pad, pkcs7_unpad)}
+
+STREAM_MODES = enc_ctr, enc_ofb, enc_cfb, enc_cfb8 # dec_* are subclasses
+
+# name: (enc mode, dec mode), modes take (block_chifer, iv)
+MODES = {
+    'ecb': (lambda bc, iv: enc_ecb(bc, len(iv)), lambda bc, iv: dec_ecb(bc, len(iv))),
+    'cbc': (enc_cbc, dec_cbc),
+    'pcbc': (enc_pcbc, dec_pcbc),
+    'ctr': (enc_ctr, dec_ctr),
+    'ofb': (enc_ofb, dec_ofb),
+    'cfb': (enc_cfb, dec_cfb),
+    'cfb8': (enc_cfb8, dec_cfb8)}
+
+
+class enc_context:
+
+    def __init__(self, mode, block_size, padding=True):
+        self.mode = mode
+        self.bs = block_size
+        self.stream = isinstance(mode, STREAM_MODES)
+        self.padding = padding and not self.stream
+        self.buf = ''
+        self.finalized = False
+
+    def update(self, data):
+        if self.finalized:
+            raise ValueError('Context is finalized')
+        if self.stream:
+            return self.mode(data)
+        buf = self.buf + data
+        n = len(buf) - len(buf) % self.bs
+        self.buf = buf[n:]
+        return self.mode(buf[:n])
+
+    def finalize(self):
+        if self.finalized:
+            raise ValueError('Context is finalized')
+        self.finalized = True
+        buf = self.buf
+        self.buf = ''
+        if self.padding:
+            return self.mode(PADDING[self.bs][0](buf))
+        if buf:
+            raise ValueError('Data are not block-aligned')
+        return ''
+
+
+class dec_context(enc_context):
+
+    def update(self, data):
+        if self.finalized:
+            raise ValueError('Context is finalized')
+        if self.stream:
+            return self.mode(data)
+        buf = self.buf + data
+        n = len(buf) - len(buf) % self.bs
+        if self.padding and n == len(buf):
+            n -= self.bs # hold back last block
+        if n <= 0:
+            self.buf = buf
+            return ''
+        self.buf = buf[n:]
+        return self.mode(buf[:n])
+
+    def finalize(self):
+        if self.finalized:
+            raise ValueError('Context is finalized')
+        self.finalized = True
+        buf = self.buf
+        self.buf = ''
+        if self.stream:
+            return ''
+        if not buf:
+            if self.padding: # padded data have at least one block
+                raise ValueError('Missing padding block')
+            return ''
+        if len(buf) != self.bs:
+            raise ValueError('Data are not block-aligned')
+        text = self.mode(buf)
+        if self.padding:
+            text = PADDING[self.bs][1](text)
+        return text
+
+
+def new_context(block_chifer, mode, iv, decrypt=False, padding=True):
+    '''Context for mode name (see MODES); iv gives block size'''
+    if mode not in MODES:
+        raise ValueError('Unknown mode %r' % mode)
+    return (enc_context, dec_context)[decrypt](
+        MODES[mode][decrypt](block_chifer, iv), len(iv), padding)
+
+
+if __name__ == '__main__':
+    from testutil import ok, pad
+    from aes import aes
+    from bf import blowfish
+    text = 'Red leather, Yellow leather. ' * 7
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        iv = 'v' * bs
+        for mode in sorted(MODES):
+            enc, dec = MODES[mode]
+            stream = isinstance(enc(c, iv), STREAM_MODES)
+            ref = enc(c, iv)(stream and text or PADDING[bs][0](text))
+            for step in 1, 5, bs, 3 * bs + 1, len(ref):
+                e = new_context(c, mode, iv)
+                cryp = ''.join([e.update(text[s:s+step])
+                                for s in xrange(0, len(text), step)]) + e.finalize()
+                d = new_context(c, mode, iv, decrypt=True)
+                t = ''.join([d.update(ref[s:s+step])
+                             for s in xrange(0, len(ref), step)]) + d.finalize()
+                if cryp != ref or t != text:
+                    break
+            print pad('%s %s' % (c.__class__.__name__, mode), 50), \
+                  'enc:', ok(cryp == ref), 'dec:', ok(t == text)
+        e = new_context(c, 'cbc', iv, padding=False)
+        d = new_context(c, 'cbc', iv, decrypt=True, padding=False)
+        aligned = text[:bs * 3]
+        cryp = e.update(aligned[:5]) + e.update(aligned[5:]) + e.finalize()
+        print pad('%s cbc no padding' % c.__class__.__name__, 50), \
+              ok(cryp == enc_cbc(c, iv)(aligned) and
+                 d.update(cryp) + d.finalize() == aligned)
+        e = new_context(c, 'ecb', iv, padding=False)
+        e.update('x')
+        try:
+            e.finalize()
+            r = False
+        except ValueError:
+            r = True
+        print pad('%s not aligned' % c.__class__.__name__, 50), ok(r)
+        d = new_context(c, 'cbc', iv, decrypt=True)
+        d.update('')
+        try:
+            d.finalize()
+            r = False
+        except ValueError:
+            r = True
+        print pad('%s padded, empty input' % c.__class__.__name__, 50), \
+              ok(r and new_context(c, 'cbc', iv, decrypt=True, padding=False).finalize() == '')
@@ -24,35 +24,208 @@
 # authors and should not be interpreted as representing official policies, either expressed
 # or implied, of Alexey V Michurin.
 
-from random import randrange
+import os
+from threading import Lock
+from lru import lru
+from binascii import hexlify, unhexlify
+from hashlib import md5 as md5_new, sha256
 try:
-    from hashlib import md5 as md5_new
+    from hashlib import pbkdf2_hmac # Python >= 2.7.8
 except ImportError:
-    # for Python < 2.5
-    from md5 import new as md5_new
+    pbkdf2_hmac = None
 
-__all__ = 'gen_salt', 'passphrase_to_salted_key_and_iv'
+__all__ = ('gen_salt', 'urandom_pool', 'passphrase_to_salted_key_and_iv', 'key_deriver',
+           'pbkdf2_sha256', 'passphrase_to_pbkdf2_key_and_iv', 'PBKDF2_ITERATIONS')
 
 __doc__ = '''Tools related to key derivation service
 
-See RFC2898 PKCS #5: Password-Based Cryptography Specification Version 2.0'''
+See RFC2898 PKCS #5: Password-Based Cryptography Specification Version 2.0
+
+gen_salt takes bytes from salt_pool, urandom_pool instance: os.urandom
+is read by large blocks, salts are sliced from buffer. Pool is
+thread-safe and is dropped in forked child, so parent and child
+never share salts.
+
+key_deriver is memoized passphrase_to_salted_key_and_iv
+bounded by number of entries (LRU):
+derive = key_deriver(size=256)
+key, iv = derive('passphrase', 'saltsalt', 32, 16)
+print derive.hits, derive.misses
+
+passphrase_to_pbkdf2_key_and_iv is PBKDF2-HMAC-SHA256 derivation
+used by openssl enc -pbkdf2 -iter N. hashlib.pbkdf2_hmac is used
+if available.'''
 
 md5 = lambda x: md5_new(x).digest()
 
+fork_lock = Lock() # serializes pool resets in forked child
+
+class urandom_pool:
+
+    def __init__(self, read_size=4096):
+        self.read_size = read_size
+        self.__reset()
+
+    def __reset(self):
+        self.buf = ''
+        self.pos = 0
+        self.lock = Lock() # lock of parent may be held by other thread
+        self.pid = os.getpid() # last: other threads check it first
+
+    def __call__(self, n):
+        if self.pid != os.getpid():
+            with fork_lock:
+                if self.pid != os.getpid(): # not reset by other thread
+                    self.__reset()
+        with self.lock:
+            if len(self.buf) - self.pos < n:
+                self.buf = self.buf[self.pos:] + os.urandom(max(self.read_size, n))
+                self.pos = 0
+            r = self.buf[self.pos:self.pos+n]
+            self.pos += n
+            return r
+
+salt_pool = urandom_pool()
+
 def gen_salt(saltlen=8):
-    return ''.join(map(lambda x: chr(randrange(256)), xrange(saltlen)))
+    return salt_pool(saltlen)
 
 def passphrase_to_salted_key_and_iv(passphrase, salt='', klen=16, ivlen=8):
+    # OpenSSL EVP_BytesToKey, MD5, one iteration:
+    # D_1 = md5(passphrase + salt), D_i = md5(D_i-1 + passphrase + salt)
     dklen = klen + ivlen
-    dk = ''
-    d = ''
-    while len(dk) < dklen:
-        d = md5(d + passphrase + salt)
-        dk += d
+    ps = passphrase + salt
+    d = md5(ps)
+    dk = [d]
+    for _ in xrange((dklen - 1) // 16):
+        d = md5(d + ps)
+        dk.append(d)
+    dk = ''.join(dk)
     return (dk[:klen], dk[klen:dklen])
 
+HMAC_IPAD = ''.join([chr(x ^ 0x36) for x in xrange(256)])
+HMAC_OPAD = ''.join([chr(x ^ 0x5c) for x in xrange(256)])
+
+def pbkdf2_sha256_python(passphrase, salt, iterations, dklen):
+    # HMAC inner and outer states are computed once and copied
+    if len(passphrase) > 64:
+        passphrase = sha256(passphrase).digest()
+    passphrase += '\0' * (64 - len(passphrase))
+    inner = sha256(passphrase.translate(HMAC_IPAD))
+    outer = sha256(passphrase.translate(HMAC_OPAD))
+    def prf(data):
+        h = inner.copy()
+        h.update(data)
+        o = outer.copy()
+        o.update(h.digest())
+        return o.digest()
+    dk = []
+    for i in xrange(1, (dklen + 31) // 32 + 1):
+        u = prf(salt + chr(i >> 24) + chr((i >> 16) & 0xff) + chr((i >> 8) & 0xff) + chr(i & 0xff))
+        t = int(hexlify(u), 16)
+        for _ in xrange(iterations - 1):
+            u = prf(u)
+            t ^= int(hexlify(u), 16)
+        dk.append(unhexlify('%064x' % t))
+    return ''.join(dk)[:dklen]
+
+def pbkdf2_sha256(passphrase, salt, iterations, dklen):
+    if iterations < 1:
+        raise ValueError('Iterations must be positive, got %r' % iterations)
+    if pbkdf2_hmac is not None:
+        return pbkdf2_hmac('sha256', passphrase, salt, iterations, dklen)
+    return pbkdf2_sha256_python(passphrase, salt, iterations, dklen)
+
+PBKDF2_ITERATIONS = 10000 # openssl enc -pbkdf2 default
+
+def passphrase_to_pbkdf2_key_and_iv(passphrase, salt='', klen=16, ivlen=8,
+                                    iterations=PBKDF2_ITERATIONS):
+    dk = pbkdf2_sha256(passphrase, salt, iterations, klen + ivlen)
+    return (dk[:klen], dk[klen:])
+
+
+class key_deriver(lru):
+
+    def __init__(self, size=256):
+        lru.__init__(self, size)
+
+    def __call__(self, passphrase, salt='', klen=16, ivlen=8):
+        k = (passphrase, salt, klen, ivlen)
+        v = self.lookup(k)
+        if v is None:
+            v = passphrase_to_salted_key_and_iv(passphrase, salt, klen, ivlen)
+            self.store(k, v)
+        return v
+
 if __name__ == '__main__':
     from testutil import ok, qrepr
     a = '\x09\x8f\x6b\xcd\x46\x21\xd3\x73\xca\xde\x4e\x83\x26\x27\xb4\xf6'
     b = md5('test')
     print qrepr(b), ok(a == b)
+    from binascii import unhexlify
+    # openssl enc -<cipher> -md md5 -P -S 0102030405060708 -pass pass:Aluminum
+    salt = unhexlify('0102030405060708')
+    for klen, ivlen, key, iv in (
+        (16, 8, '3C57D221B3B47E2CBBE17E91715A3E0D', 'EF60A25470DB4C16'),
+        (32, 16, '3C57D221B3B47E2CBBE17E91715A3E0DEF60A25470DB4C16E980457F993EDDB1',
+         '1D05064A0245539B9E362B1BD02AD3E5')):
+        k, i = passphrase_to_salted_key_and_iv('Aluminum', salt, klen, ivlen)
+        print qrepr(k + i), ok(k == unhexlify(key) and i == unhexlify(iv))
+    derive = key_deriver(size=2)
+    r = derive('pass', 'salt', 56, 8) == passphrase_to_salted_key_and_iv('pass', 'salt', 56, 8)
+    derive('pass', 'salt', 56, 8)
+    derive('pass', 'other', 56, 8)
+    derive('pass', '', 16, 8)
+    pool = urandom_pool(read_size=20)
+    salts = [pool(8) for _ in xrange(10)]
+    print 'urandom_pool', ok(map(len, salts) == [8] * 10 and len(set(salts)) == 10 and
+                             len(pool(100)) == 100)
+    if hasattr(os, 'fork'):
+        pool(1)
+        rd, wr = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(wr, pool(8))
+            os._exit(0)
+        os.close(wr)
+        child = os.read(rd, 8)
+        os.close(rd)
+        os.waitpid(pid, 0)
+        print 'urandom_pool fork', ok(len(child) == 8 and child != pool(8))
+        from threading import Thread
+        pid = os.fork()
+        if pid == 0: # threads of child race for the first reset
+            got = []
+            threads = [Thread(target=lambda: got.extend(pool(8) for _ in xrange(50)))
+                       for _ in xrange(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            os._exit(len(set(got)) != 400)
+        print 'urandom_pool fork, threads', ok(os.waitpid(pid, 0)[1] == 0)
+    print 'key_deriver', ok(r and derive.hits == 1 and derive.misses == 3 and len(derive) == 2)
+    # RFC 7914, 11. Test Vectors for PBKDF2 with HMAC-SHA-256
+    for passphrase, salt, iterations, dk in (
+        ('passwd', 'salt', 1,
+         '55ac046e56e3089fec1691c22544b605f94185216dde0465e68b9d57c20dacbc'
+         '49ca9cccf179b645991664b39d77ef317c71b845b1e30bd509112041d3a19783'),
+        ('Password', 'NaCl', 80000,
+         '4ddcd8f60b98be21830cee5ef22701f9641a4418d04c0414aeff08876b34ab56'
+         'a1d425a1225833549adb841b51c9b3176a272bdebba1d078478f62b397f33c8d')):
+        dk = unhexlify(dk)
+        print 'pbkdf2 %d iterations' % iterations, \
+              ok(pbkdf2_sha256(passphrase, salt, iterations, 64) == dk), \
+              ok(pbkdf2_sha256_python(passphrase, salt, min(iterations, 1000), 64) ==
+                 (iterations <= 1000 and dk or pbkdf2_sha256(passphrase, salt, 1000, 64)))
+    # openssl enc -aes-256-cbc -pbkdf2 -P -S 0102030405060708 -pass pass:Aluminum
+    k, i = passphrase_to_pbkdf2_key_and_iv('Aluminum', unhexlify('0102030405060708'), 32, 16)
+    try:
+        pbkdf2_sha256('passwd', 'salt', 0, 32)
+        r = False
+    except ValueError:
+        r = True
+    print 'pbkdf2 zero iterations', ok(r)
+    print 'pbkdf2 openssl', \
+          ok(k == unhexlify('A4F2AE2853FA09DBE81A29751F11181D38BE39539AE1009DFDF16A28DA9910D4') and
+             i == unhexlify('A8E34F4AD9A144B63C3F66C5FBC7417A'))
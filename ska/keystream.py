@@ -0,0 +1,198 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from threading import Condition, Thread
+from collections import deque
+from time import time
+from mode import enc_ctr, xor_buffer
+
+__all__ = 'keystream_pool',
+
+__doc__ = '''CTR keystream generated ahead of time
+
+keystream_pool keeps CTR keystream of one session (block cipher
+and iv, see ska.mode.enc_ctr) generated by background thread,
+up to byte_budget bytes, by chunks of chunk_size bytes. A call
+costs XOR only while pool has enough keystream; otherwise missing
+keystream is generated inline. Output is the same as enc_ctr
+(and dec_ctr) gives. Note: thread shares GIL with caller, so keystream
+is produced in idle time between calls.
+
+Metrics:
+hits, misses -- bytes of keystream taken from pool/generated inline
+hit_ratio -- hits / (hits + misses)
+refill_lag, max_refill_lag -- seconds from the moment pool was drained
+below budget until it was full again (last, maximal)
+discarded -- chunks thrown away because inline generation took over
+
+Example:
+from ska.keystream import keystream_pool
+from ska.aes import aes
+pool = keystream_pool(aes(key), nonce, byte_budget=1<<20)
+pool.wait_full(1)
+crypted = pool(text)
+pool.close()
+'''
+
+
+class keystream_pool:
+
+    def __init__(self, block_chifer, iv, byte_budget=1<<20, chunk_size=1<<14,
+                 block_offset=0, counter_size=None, little_endian=False):
+        self.ctr = enc_ctr(block_chifer, iv, block_offset, counter_size, little_endian)
+        self.bs = self.ctr.bs
+        self.byte_budget = byte_budget
+        self.chunk_blocks = max(chunk_size // self.bs, 1)
+        self.chunks = deque() # keystream after current position, in order
+        self.nbytes = 0
+        self.end = block_offset # first block not queued yet
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.refill_lag = 0.
+        self.max_refill_lag = 0.
+        self.drained_at = None
+        self.closed = False
+        self.cond = Condition()
+        self.thread = Thread(target=self.__refill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return total and float(self.hits) / total
+
+    def __refill(self):
+        cond = self.cond
+        while True:
+            with cond:
+                while not self.closed and self.nbytes >= self.byte_budget:
+                    cond.wait()
+                if self.closed:
+                    return
+                start = self.end
+            ks = self.ctr.keystream(start, self.chunk_blocks)
+            with cond:
+                if start != self.end: # blocks were generated inline
+                    self.discarded += 1
+                    continue
+                self.chunks.append(ks)
+                self.nbytes += len(ks)
+                self.end += self.chunk_blocks
+                if self.nbytes >= self.byte_budget:
+                    if self.drained_at is not None:
+                        self.refill_lag = time() - self.drained_at
+                        self.max_refill_lag = max(self.max_refill_lag, self.refill_lag)
+                        self.drained_at = None
+                    cond.notify_all()
+
+    def wait_full(self, timeout=None):
+        '''Wait until pool is full, return True if it is'''
+        if timeout is not None:
+            deadline = time() + timeout
+        with self.cond:
+            while not self.closed and self.nbytes < self.byte_budget:
+                if timeout is None:
+                    self.cond.wait()
+                else:
+                    left = deadline - time()
+                    if left <= 0:
+                        break
+                    self.cond.wait(left)
+            return self.nbytes >= self.byte_budget
+
+    def __call__(self, text): # any length
+        n = len(text)
+        with self.cond:
+            parts = []
+            got = 0
+            chunks = self.chunks
+            while chunks and got < n:
+                ks = chunks.popleft()
+                if got + len(ks) > n:
+                    chunks.appendleft(ks[n-got:])
+                    ks = ks[:n-got]
+                parts.append(ks)
+                got += len(ks)
+            if self.nbytes >= self.byte_budget and got:
+                self.drained_at = time()
+            self.nbytes -= got
+            self.hits += got
+            if got < n:
+                count = (n - got + self.bs - 1) // self.bs
+                ks = self.ctr.keystream(self.end, count)
+                self.end += count
+                self.misses += n - got
+                parts.append(ks[:n-got])
+                if len(ks) > n - got:
+                    chunks.append(ks[n-got:])
+                    self.nbytes += len(ks) - (n - got)
+            self.cond.notify_all()
+        return xor_buffer(text, ''.join(parts))
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.chunks.clear()
+            self.nbytes = 0
+            self.cond.notify_all()
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    from testutil import ok, pad
+    from aes import aes
+    from bf import blowfish
+    text = ''.join(map(chr, range(256))) * 64
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        iv = 'n' * bs
+        name = c.__class__.__name__
+        ref = enc_ctr(c, iv)(text)
+        pool = keystream_pool(c, iv, byte_budget=4096, chunk_size=1000)
+        full = pool.wait_full(10)
+        e = pool(text[:100])
+        print pad('%s pool full, hit' % name, 50), \
+              ok(full and e == ref[:100] and pool.hits == 100 and pool.misses == 0)
+        e += pool(text[100:10000]) # more than budget: inline fallback
+        print pad('%s dry pool, inline' % name, 50), \
+              ok(e == ref[:10000] and pool.misses > 0 and 0 < pool.hit_ratio < 1)
+        for s in xrange(10000, len(text), 777):
+            e += pool(text[s:s+777])
+        print pad('%s odd chunks' % name, 50), ok(e == ref)
+        pool.wait_full(10)
+        print pad('%s refill lag' % name, 50), ok(pool.max_refill_lag > 0)
+        pool.close()
+        d = keystream_pool(c, iv, block_offset=3)
+        print pad('%s decrypt, block offset' % name, 50), \
+              ok(d(enc_ctr(c, iv, 3)(text)) == text)
+        d.close()
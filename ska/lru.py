@@ -0,0 +1,125 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from threading import Lock
+from collections import OrderedDict
+
+__all__ = 'lru',
+
+__doc__ = '''Thread-safe LRU mapping, base of ska.cache and ska.key.key_deriver
+
+Entries are bounded by number and, optionally, by total
+of sizes given to store. Computation of missed values is
+up to caller and is done outside the lock.
+
+Example:
+from ska.lru import lru
+c = lru(size=2)
+v = c.lookup('k')
+if v is None:
+    v = compute('k')
+    c.store('k', v)
+print c.hits, c.misses
+'''
+
+
+class lru:
+
+    def __init__(self, size, byte_budget=None):
+        self.size = size
+        self.byte_budget = byte_budget
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self.__entries = OrderedDict() # key -> (value, nbytes)
+        self.__lock = Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def lookup(self, k):
+        '''Return value or None; counts hits and misses'''
+        with self.__lock:
+            e = self.__entries.pop(k, None)
+            if e is None:
+                self.misses += 1
+                return None
+            self.__entries[k] = e # move to the end (most recent)
+            self.hits += 1
+            return e[0]
+
+    def store(self, k, v, nbytes=0):
+        with self.__lock:
+            if k in self.__entries or (self.byte_budget is not None and
+                                       nbytes > self.byte_budget):
+                return
+            self.__entries[k] = (v, nbytes)
+            self.nbytes += nbytes
+            self.__shrink()
+
+    def __shrink(self):
+        while self.__entries and (len(self.__entries) > self.size or
+                                  self.byte_budget is not None and
+                                  self.nbytes > self.byte_budget):
+            self.nbytes -= self.__entries.popitem(last=False)[1][1]
+
+    def resize(self, size=None, byte_budget=None):
+        with self.__lock:
+            if size is not None:
+                self.size = size
+            if byte_budget is not None:
+                self.byte_budget = byte_budget
+            self.__shrink()
+
+    def drop(self, match):
+        '''Drop entries with match(key) true'''
+        with self.__lock:
+            for k in self.__entries.keys():
+                if match(k):
+                    self.nbytes -= self.__entries.pop(k)[1]
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.nbytes = 0
+
+
+if __name__ == '__main__':
+    from testutil import ok, pad
+    c = lru(size=2, byte_budget=10)
+    c.store('a', 1, 4)
+    c.store('b', 2, 4)
+    print pad('hit', 50), ok(c.lookup('a') == 1 and c.hits == 1)
+    print pad('miss', 50), ok(c.lookup('x') is None and c.misses == 1)
+    c.store('c', 3, 4) # 'b' is least recently used
+    print pad('byte budget', 50), ok(len(c) == 2 and c.lookup('b') is None and
+                                     c.nbytes == 8)
+    c.store('d', 4, 11)
+    print pad('too large value', 50), ok(c.lookup('d') is None)
+    c.resize(size=1)
+    print pad('size limit', 50), ok(len(c) == 1 and c.lookup('c') == 3)
+    c.drop(lambda k: k == 'c')
+    print pad('drop', 50), ok(len(c) == 0 and c.nbytes == 0)
@@ -24,17 +24,74 @@
 # authors and should not be interpreted as representing official policies, either expressed
 # or implied, of Alexey V Michurin.
 
+from struct import pack, unpack
+from binascii import hexlify, unhexlify
 
-__all__ = 'enc_ecb', 'dec_ecb', 'enc_cbc', 'dec_cbc', 'enc_pcbc', 'dec_pcbc'
+__all__ = ('enc_ecb', 'dec_ecb', 'enc_cbc', 'dec_cbc', 'enc_pcbc', 'dec_pcbc',
+           'enc_cbc_multi', 'enc_ctr', 'dec_ctr',
+           'enc_ofb', 'dec_ofb', 'enc_cfb', 'dec_cfb', 'enc_cfb8', 'dec_cfb8')
 
 __doc__ = '''Block cipher modes of operation
 
-Supported modes: ECB, CBC, PCBC
+Supported modes: ECB, CBC, PCBC, CTR, OFB, CFB, CFB8
 Supported block size: 64, 128 bits
+
+CTR, OFB, CFB (segment is a whole block) and CFB8 (segment
+is a byte) are stream modes and need no padding: text of any
+length is accepted, unused keystream is kept for the next call.
+
+Block cipher interface:
+enc(text), dec(text) -- encrypt/decrypt one block;
+enc_blocks(text), dec_blocks(text) -- optional, encrypt/decrypt
+buffer of many blocks at once (see ska.aes, ska.bf).
+Where blocks are independent (ECB, cipher step of CBC and PCBC
+decryption, CTR keystream), modes hand the whole buffer
+to enc_blocks/dec_blocks; block by block is used for ciphers
+without them.
+
+enc_cbc_multi encrypts number of independent messages at once:
+blocks at the same position of all messages are handed
+to enc_blocks together. Result is the same as enc_cbc gives
+for every message with its own iv:
+enc_cbc_multi(bc, [iv1, iv2])([text1, text2]) == \\
+    [enc_cbc(bc, iv1)(text1), enc_cbc(bc, iv2)(text2)]
 '''
 
+def xor_buffer(a, b): # len(a) == len(b), whole buffer as one long integer
+    if not a:
+        return ''
+    return unhexlify('%0*x' % (len(a) << 1,
+                               int(hexlify(a), 16) ^ int(hexlify(b), 16)))
+
+def xor_64(a, b):
+    return pack('>Q', unpack('>Q', a)[0] ^ unpack('>Q', b)[0])
+
+def xor_128(a, b):
+    x = unpack('>QQ', a)
+    y = unpack('>QQ', b)
+    return pack('>QQ', x[0] ^ y[0], x[1] ^ y[1])
+
+def xor_func(size):
+    '''Return the fastest XOR for two strings of given size'''
+    return {8: xor_64, 16: xor_128}.get(size, xor_buffer)
+
 def xor_text(a, b):
-    return ''.join(map(lambda x: chr(ord(x[0])^ord(x[1])), zip(a, b)))
+    n = min(len(a), len(b))
+    return xor_buffer(a[:n], b[:n])
+
+def enc_blocks(block_chifer, text, block_size):
+    f = getattr(block_chifer, 'enc_blocks', None)
+    if f is not None:
+        return f(text)
+    enc = block_chifer.enc
+    return ''.join([enc(text[s:s+block_size]) for s in xrange(0, len(text), block_size)])
+
+def dec_blocks(block_chifer, text, block_size):
+    f = getattr(block_chifer, 'dec_blocks', None)
+    if f is not None:
+        return f(text)
+    dec = block_chifer.dec
+    return ''.join([dec(text[s:s+block_size]) for s in xrange(0, len(text), block_size)])
 
 
 class enc_ecb:
@@ -46,11 +103,14 @@ class enc_ecb:
     def _one_step(self, text): # len(text) == block_size
         return self.bc.enc(text)
 
+    def _step_by_step(self, text):
+        # blocks are collected and joined once: linear time and memory
+        step = self._one_step
+        bs = self.bs
+        return ''.join([step(text[s:s+bs]) for s in xrange(0, len(text), bs)])
+
     def __call__(self, text): # len(text) % block_size == 0
-        crypted = ''
-        for s in xrange(0, len(text), self.bs):
-            crypted += self._one_step(text[s:s+self.bs])
-        return crypted
+        return enc_blocks(self.bc, text, self.bs)
 
 
 class dec_ecb(enc_ecb):
@@ -58,6 +118,9 @@ class dec_ecb(enc_ecb):
     def _one_step(self, crypted):
         return self.bc.dec(crypted)
 
+    def __call__(self, crypted):
+        return dec_blocks(self.bc, crypted, self.bs)
+
 
 class enc_cbc(enc_ecb):
 
@@ -65,35 +128,290 @@ class enc_cbc(enc_ecb):
         self.c = iv
         self.bc = block_chifer
         self.bs = len(iv)
+        self.xor = xor_func(self.bs)
 
     def _one_step(self, text):
-        self.c = self.bc.enc(xor_text(self.c, text))
+        self.c = self.bc.enc(self.xor(self.c, text))
         return self.c
 
+    def __call__(self, text):
+        return self._step_by_step(text)
+
 
 class dec_cbc(enc_cbc):
 
     def _one_step(self, crypted):
-        text = xor_text(self.bc.dec(crypted), self.c)
+        text = self.xor(self.bc.dec(crypted), self.c)
         self.c = crypted
         return text
 
+    def __call__(self, crypted):
+        # cipher step is independent for every block
+        if not crypted:
+            return ''
+        c = self.c + crypted[:-self.bs]
+        self.c = crypted[-self.bs:]
+        return xor_buffer(dec_blocks(self.bc, crypted, self.bs), c)
+
 
 class enc_pcbc(enc_cbc):
 
     def _one_step(self, text):
-        c = self.bc.enc(xor_text(self.c, text))
-        self.c = xor_text(text, c)
+        c = self.bc.enc(self.xor(self.c, text))
+        self.c = self.xor(text, c)
         return c
 
 
 class dec_pcbc(enc_cbc):
 
     def _one_step(self, crypted):
-        p = xor_text(self.bc.dec(crypted), self.c)
-        self.c = xor_text(p, crypted)
+        p = self.xor(self.bc.dec(crypted), self.c)
+        self.c = self.xor(p, crypted)
         return p
 
+    def __call__(self, crypted):
+        # cipher step is independent for every block, chaining is not
+        d = dec_blocks(self.bc, crypted, self.bs)
+        xor = self.xor
+        bs = self.bs
+        c = self.c
+        text = []
+        for s in xrange(0, len(crypted), bs):
+            p = xor(d[s:s+bs], c)
+            c = xor(p, crypted[s:s+bs])
+            text.append(p)
+        self.c = c
+        return ''.join(text)
+
+
+class enc_cbc_multi:
+
+    def __init__(self, block_chifer, ivs):
+        self.cs = list(ivs)
+        if not self.cs:
+            raise ValueError('At least one IV is required')
+        self.bc = block_chifer
+        self.bs = len(self.cs[0])
+
+    def __call__(self, texts): # len(texts) == len(ivs)
+        bc = self.bc
+        bs = self.bs
+        cs = self.cs
+        out = [[] for t in texts]
+        active = [i for i in xrange(len(texts)) if texts[i]]
+        s = 0
+        while active:
+            # one step: block s of every message not finished yet
+            c = enc_blocks(bc, xor_buffer(''.join([cs[i] for i in active]),
+                                          ''.join([texts[i][s:s+bs] for i in active])), bs)
+            for k in xrange(len(active)):
+                i = active[k]
+                cs[i] = c[k*bs:k*bs+bs]
+                out[i].append(cs[i])
+            s += bs
+            active = [i for i in active if len(texts[i]) > s]
+        return [''.join(o) for o in out]
+
+
+class enc_ctr:
+
+    '''Counter mode
+
+    iv is the initial counter block: nonce prefix followed by
+    counter_size bytes of counter (whole block by default).
+    Counter is big-endian unless little_endian is set, it wraps
+    around without carry into the nonce.
+    block_offset -- number of the first keystream block to use.
+    '''
+
+    def __init__(self, block_chifer, iv, block_offset=0,
+                 counter_size=None, little_endian=False):
+        self.bc = block_chifer
+        self.bs = len(iv)
+        if counter_size is None:
+            counter_size = self.bs
+        self.cs = counter_size
+        self.le = little_endian
+        self.prefix = iv[:self.bs-counter_size]
+        c = iv[self.bs-counter_size:]
+        if little_endian:
+            c = c[::-1]
+        self.c0 = int(hexlify(c) or '0', 16)
+        self.mask = (1 << (counter_size * 8)) - 1
+        self.block = block_offset # next keystream block
+        self.ks = '' # keystream left from previous call
+
+    def counter_block(self, n):
+        c = unhexlify('%0*x' % (self.cs << 1, (self.c0 + n) & self.mask))
+        if self.le:
+            c = c[::-1]
+        return self.prefix + c
+
+    def keystream(self, block, count):
+        '''Keystream blocks [block, block+count) as one string'''
+        counters = ''.join(map(self.counter_block, xrange(block, block + count)))
+        return enc_blocks(self.bc, counters, self.bs)
+
+    def seek(self, offset):
+        '''Continue from byte offset of the stream'''
+        self.block, r = divmod(offset, self.bs)
+        self.ks = ''
+        if r:
+            self.ks = self.keystream(self.block, 1)[r:]
+            self.block += 1
+
+    def __call__(self, text): # any length
+        n = len(text)
+        ks = self.ks
+        if len(ks) < n:
+            count = (n - len(ks) + self.bs - 1) // self.bs
+            ks += self.keystream(self.block, count)
+            self.block += count
+        self.ks = ks[n:]
+        return xor_buffer(text, ks[:n])
+
+
+class dec_ctr(enc_ctr):
+    pass
+
+
+class enc_ofb:
+
+    '''Output feedback mode'''
+
+    def __init__(self, block_chifer, iv):
+        self.bc = block_chifer
+        self.bs = len(iv)
+        self.c = iv # last keystream block
+        self.ks = '' # keystream left from previous call
+
+    def keystream(self, count): # blocks depend on each other: one by one
+        enc = self.bc.enc
+        c = self.c
+        ks = []
+        for _ in xrange(count):
+            c = enc(c)
+            ks.append(c)
+        self.c = c
+        return ''.join(ks)
+
+    def __call__(self, text): # any length
+        n = len(text)
+        ks = self.ks
+        if len(ks) < n:
+            ks += self.keystream((n - len(ks) + self.bs - 1) // self.bs)
+        self.ks = ks[n:]
+        return xor_buffer(text, ks[:n])
+
+
+class dec_ofb(enc_ofb):
+    pass
+
+
+class enc_cfb:
+
+    '''Cipher feedback mode, segment is a whole block'''
+
+    def __init__(self, block_chifer, iv):
+        self.bc = block_chifer
+        self.bs = len(iv)
+        self.xor = xor_func(self.bs)
+        self.c = iv # last complete crypted block
+        self.ks = '' # keystream left for current block
+        self.part = '' # crypted part of current block
+
+    def _feed(self, crypted):
+        self.part += crypted
+        if len(self.part) == self.bs:
+            self.c = self.part
+            self.part = ''
+
+    def __call__(self, text): # any length
+        bs = self.bs
+        cryp = []
+        s = 0
+        n = len(text)
+        while s < n:
+            ks = self.ks or self.bc.enc(self.c)
+            m = min(len(ks), n - s)
+            if m == bs:
+                c = self.xor(text[s:s+bs], ks)
+            else:
+                c = xor_buffer(text[s:s+m], ks[:m])
+            self.ks = ks[m:]
+            self._feed(c)
+            cryp.append(c)
+            s += m
+        return ''.join(cryp)
+
+
+class dec_cfb(enc_cfb):
+
+    def __call__(self, crypted): # any length
+        head = ''
+        if self.ks: # finish current block
+            m = min(len(self.ks), len(crypted))
+            head = xor_buffer(crypted[:m], self.ks[:m])
+            self.ks = self.ks[m:]
+            self._feed(crypted[:m])
+            crypted = crypted[m:]
+        n = len(crypted)
+        if not n:
+            return head
+        # all cipher inputs are known: whole buffer at once
+        bs = self.bs
+        count = (n + bs - 1) // bs
+        ks = enc_blocks(self.bc, self.c + crypted[:(count-1)*bs], bs)
+        r = n - (count - 1) * bs # size of last, maybe partial, block
+        if count > 1:
+            self.c = crypted[(count-2)*bs:(count-1)*bs]
+        self.ks = ks[n:]
+        self._feed(crypted[n-r:])
+        return head + xor_buffer(crypted, ks[:n])
+
+
+CFB8_WINDOW = 4096 # bytes of ciphertext per dec_cfb8 batch
+
+class enc_cfb8:
+
+    '''Cipher feedback mode, segment is one byte
+
+    It takes one block cipher operation per byte.
+    '''
+
+    def __init__(self, block_chifer, iv):
+        self.bc = block_chifer
+        self.bs = len(iv)
+        self.r = iv # shift register
+
+    def __call__(self, text): # any length
+        enc = self.bc.enc
+        r = self.r
+        cryp = []
+        for t in text:
+            c = chr(ord(enc(r)[0]) ^ ord(t))
+            r = r[1:] + c
+            cryp.append(c)
+        self.r = r
+        return ''.join(cryp)
+
+
+class dec_cfb8(enc_cfb8):
+
+    def __call__(self, crypted): # any length
+        # register for every byte is known: all cipher inputs of
+        # a window at once, memory is bounded by CFB8_WINDOW * bs
+        bs = self.bs
+        text = []
+        for w in xrange(0, len(crypted), CFB8_WINDOW):
+            c = crypted[w:w+CFB8_WINDOW]
+            n = len(c)
+            r = self.r + c
+            ks = enc_blocks(self.bc, ''.join([r[s:s+bs] for s in xrange(n)]), bs)
+            self.r = r[n:]
+            text.append(xor_buffer(c, ks[::bs]))
+        return ''.join(text)
+
 
 if __name__ == '__main__':
     from testutil import ok, pad
@@ -127,3 +445,103 @@ if __name__ == '__main__':
         test('PCBC', enc_pcbc, dec_pcbc, bs)
         test('CBC', enc_cbc, dec_cbc, bs)
         test('ECB', lambda c, iv: enc_ecb(c, len(iv)), lambda c, iv: dec_ecb(c, len(iv)), bs)
+    print 'Test XOR'
+    for a, b in (('', ''), ('\x00\xff', '\xff\xff'), ('A'*8, 'abcdefgh'),
+                 ('\x01'*16, ''.join(map(chr, range(16)))), ('A'*5, 'B'*7)):
+        r = ''.join(map(lambda x: chr(ord(x[0])^ord(x[1])), zip(a, b)))
+        print pad('     size %d' % len(r), 70), \
+              ok(xor_text(a, b) == r and (len(a) != len(b) or xor_func(len(a))(a, b) == r))
+    print 'Test mode CTR'
+    from aes import aes
+    from bf import blowfish
+    # NIST SP 800-38A, F.5.1 CTR-AES128.Encrypt
+    c = aes('\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c')
+    iv = '\xf0\xf1\xf2\xf3\xf4\xf5\xf6\xf7\xf8\xf9\xfa\xfb\xfc\xfd\xfe\xff'
+    text = '\x6b\xc1\xbe\xe2\x2e\x40\x9f\x96\xe9\x3d\x7e\x11\x73\x93\x17\x2a' \
+           '\xae\x2d\x8a\x57\x1e\x03\xac\x9c\x9e\xb7\x6f\xac\x45\xaf\x8e\x51' \
+           '\x30\xc8\x1c\x46\xa3\x5c\xe4\x11\xe5\xfb\xc1\x19\x1a\x0a\x52\xef' \
+           '\xf6\x9f\x24\x45\xdf\x4f\x9b\x17\xad\x2b\x41\x7b\xe6\x6c\x37\x10'
+    cryp = '\x87\x4d\x61\x91\xb6\x20\xe3\x26\x1b\xef\x68\x64\x99\x0d\xb6\xce' \
+           '\x98\x06\xf6\x6b\x79\x70\xfd\xff\x86\x17\x18\x7b\xb9\xff\xfd\xff' \
+           '\x5a\xe4\xdf\x3e\xdb\xd5\xd3\x5e\x5b\x4f\x09\x02\x0d\xb0\x3e\xab' \
+           '\x1e\x03\x1d\xda\x2f\xbe\x03\xd1\x79\x21\x70\xa0\xf3\x00\x9c\xee'
+    print pad('     NIST vector', 70), ok(enc_ctr(c, iv)(text) == cryp)
+    e = enc_ctr(c, iv)
+    print pad('     odd chunks', 70), ok(e(text[:5]) + e(text[5:37]) + e(text[37:]) == cryp)
+    print pad('     block offset', 70), ok(dec_ctr(c, iv, 2)(cryp[32:]) == text[32:])
+    d = dec_ctr(c, iv)
+    d.seek(21)
+    print pad('     seek', 70), ok(d(cryp[21:50]) == text[21:50])
+    # little-endian 32-bit counter after 4-byte nonce, wraps around
+    e = enc_ctr(blowfish('key'), 'NNNN\xff\xff\xff\xff', counter_size=4, little_endian=True)
+    print pad('     counter layout', 70), \
+          ok(e.counter_block(1) == 'NNNN\x00\x00\x00\x00' and
+             e.counter_block(2) == 'NNNN\x01\x00\x00\x00')
+    print pad('     blowfish', 70), ok(dec_ctr(blowfish('key'), iv[:8])(
+                                        enc_ctr(blowfish('key'), iv[:8])(text[:23])) == text[:23])
+    print 'Test modes OFB, CFB, CFB8'
+    from binascii import unhexlify
+    text = 'Red leather, Yellow leather.'
+    key = unhexlify('000102030405060708090a0b0c0d0e0f')
+    iv = unhexlify('0001020304050607')
+    # openssl enc -<mode> -K <key> -iv <iv> (iv is padded by zeros)
+    for c, bs, mode_name, enc_mode, dec_mode, cryp in (
+        (blowfish(key), 8, 'bf-ofb', enc_ofb, dec_ofb, 'd40a3a5289ff7825dba7a112ad0381daabfb4d79a49be3fa80fb146f'),
+        (blowfish(key), 8, 'bf-cfb', enc_cfb, dec_cfb, 'd40a3a5289ff782590e8e396c4558c8bfc7d86a6b8d1a376a1107cf7'),
+        (aes(key), 16, 'aes-128-ofb', enc_ofb, dec_ofb, 'cfa7e717bab6d5ca5068a501ae05a4c93abaf5fa46b55d1f826798de'),
+        (aes(key), 16, 'aes-128-cfb', enc_cfb, dec_cfb, 'cfa7e717bab6d5ca5068a501ae05a4c90e47f12e1b7c519e5a1e2093'),
+        (aes(key), 16, 'aes-128-cfb8', enc_cfb8, dec_cfb8, 'cf49a9e0de9ab76c8b762952753ad487386c5100507241b9f8197e20')):
+        civ = iv + '\x00' * (bs - len(iv))
+        cryp = unhexlify(cryp)
+        name = 'openssl -' + mode_name
+        e = enc_mode(c, civ)
+        d = dec_mode(c, civ)
+        print pad('     %s' % name, 70), \
+              ok(enc_mode(c, civ)(text) == cryp and dec_mode(c, civ)(cryp) == text)
+        print pad('     %s odd chunks' % name, 70), \
+              ok(e(text[:3]) + e(text[3:3]) + e(text[3:20]) + e(text[20:]) == cryp and
+                 d(cryp[:5]) + d(cryp[5:9]) + d('') + d(cryp[9:]) == text)
+        long_text = text * 300
+        e = enc_mode(c, civ)
+        long_cryp = ''.join([e(long_text[s:s+1001]) for s in xrange(0, len(long_text), 1001)])
+        d = dec_mode(c, civ)
+        print pad('     %s long text' % name, 70), \
+              ok(long_cryp == enc_mode(c, civ)(long_text) and
+                 ''.join([d(long_cryp[s:s+333]) for s in xrange(0, len(long_cryp), 333)]) == long_text and
+                 dec_mode(c, civ)(long_cryp) == long_text) # CFB8: several windows
+    print 'Test multi-block interface'
+    class one_block_chifer: # third-party cipher: no enc_blocks/dec_blocks
+        def __init__(self, c):
+            self.enc = c.enc
+            self.dec = c.dec
+    text = ''.join(map(chr, range(256))) * 32
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        iv = 'v' * bs
+        for name, m in (('ECB enc', lambda c, iv: enc_ecb(c, bs)),
+                        ('ECB dec', lambda c, iv: dec_ecb(c, bs)),
+                        ('CBC dec', dec_cbc), ('PCBC dec', dec_pcbc), ('CTR', enc_ctr)):
+            ref = m(one_block_chifer(c), iv)(text)
+            e = m(c, iv)
+            t = e(text[:256]) + e(text[256:]) + e('') # small, large, empty
+            print pad('     %s %s' % (c.__class__.__name__, name), 70), \
+                  ok(m(c, iv)(text) == ref and t == ref)
+    print 'Test multi-buffer CBC'
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        ivs = ['%0*d' % (bs, i) for i in range(300)]
+        texts = [text[:bs * (i % 37)] for i in range(300)] # different lengths, some empty
+        m = enc_cbc_multi(c, ivs)
+        r = m(texts)
+        r2 = m(texts)
+        ref = []
+        ref2 = []
+        for iv, t in zip(ivs, texts):
+            e = enc_cbc(c, iv)
+            ref.append(e(t))
+            ref2.append(e(t))
+        print pad('     %s' % c.__class__.__name__, 70), ok(r == ref and r2 == ref2)
+    try:
+        enc_cbc_multi(aes('k' * 16), [])
+        r = False
+    except ValueError:
+        r = True
+    print pad('     no IVs', 70), ok(r)
@@ -24,9 +24,16 @@
 # authors and should not be interpreted as representing official policies, either expressed
 # or implied, of Alexey V Michurin.
 
-
-from key import gen_salt
+import os
+import sys
+from mmap import mmap, ACCESS_READ, ACCESS_WRITE
+from key import gen_salt, PBKDF2_ITERATIONS
+from bf import blowfish
+from aes import aes
+from context import MODES, PADDING, enc_context, dec_context
+from seek import decrypt_range, read_at
 from shortcuts import \
+    cache, \
     enc_bf_ecb, dec_bf_ecb, \
     enc_bf_cbc, dec_bf_cbc, \
     enc_aes_ecb, dec_aes_ecb, \
@@ -40,7 +47,9 @@ __all__ = ('openssl_enc_bf_ecb', 'openssl_dec_bf_ecb',
            'openssl_enc_aes_256_ecb', 'openssl_dec_aes_256_ecb',
            'openssl_enc_aes_128_cbc', 'openssl_dec_aes_128_cbc',
            'openssl_enc_aes_192_cbc', 'openssl_dec_aes_192_cbc',
-           'openssl_enc_aes_256_cbc', 'openssl_dec_aes_256_cbc')
+           'openssl_enc_aes_256_cbc', 'openssl_dec_aes_256_cbc',
+           'EncryptingWriter', 'DecryptingReader', 'openssl_decrypt_range',
+           'openssl_enc_file', 'openssl_dec_file')
 
 __doc__ = '''OpenSSL-compat leyer
 
@@ -56,16 +65,57 @@ openssl_enc_aes_128_cbc('passphrase', 'text', True)
 is the same as
 echo -n 'text' | openssl enc -aes-128-cbc -salt -pass pass:passphrase
 and
+openssl_enc_aes_128_cbc('passphrase', 'text', True, iterations=1000)
+is the same as
+echo -n 'text' | openssl enc -aes-128-cbc -salt -pbkdf2 -iter 1000 -pass pass:passphrase
+and
 openssl_dec_bf_cbc('passphrase', open('encrypted', 'r').read())
 is the same as
 cat encrypted | openssl dec -bf-cbc -pass pass:passphrase
+Salts are taken from ska.key.gen_salt; all encrypting functions
+accept provider, a callable returning n random bytes, instead.
+
+EncryptingWriter and DecryptingReader wrap file objects and
+do the same chunk by chunk, memory usage is bounded:
+w = EncryptingWriter(open('encrypted', 'wb'), 'passphrase', 'aes-128-cbc')
+w.write('text')
+w.close() # writes padded last block, fileobj is left open
+is the same as
+echo -n 'text' | openssl enc -aes-128-cbc -salt -pass pass:passphrase >encrypted
+and
+r = DecryptingReader(open('encrypted', 'rb'), 'passphrase', 'aes-128-cbc')
+text = r.read()
+
+openssl_decrypt_range decrypts a part of ECB or CBC encrypted
+file (or mmap, or string) without reading whole file:
+text = openssl_decrypt_range('passphrase', open('encrypted', 'rb'),
+                             10**9, 100, 'aes-256-cbc')
+
+openssl_enc_file and openssl_dec_file map input file and
+preallocated output file into memory and process data by
+block-aligned windows:
+openssl_enc_file('passphrase', 'text', 'encrypted', 'aes-128-cbc')
+is the same as
+openssl enc -aes-128-cbc -salt -pass pass:passphrase -in text -out encrypted
+
+Command line (openssl enc compatible subset):
+python -m ska.openssl [enc] -e|-d -<cipher> [-salt|-nosalt]
+                      [-pbkdf2] [-iter N]
+                      -pass pass:<passphrase> [-in file] [-out file]
+stdin/stdout are used if -in/-out are omitted. Key derivation is
+MD5-based, as in openssl(1) before 1.1.0 (use -md md5 with newer
+openssl), or PBKDF2-HMAC-SHA256 with -pbkdf2 or -iter N (default
+10000 iterations, as in openssl(1)). In functions iterations=None
+means MD5 derivation, number means PBKDF2 with given iterations.
+Without arguments self-test is run.
 '''
 
 
-def enc_header(salted, salt):
+def enc_header(salted, salt, provider=None):
+    '''provider(n) returns n random bytes, ska.key.gen_salt by default'''
     if salted:
         if salt is None:
-            salt = gen_salt(8)
+            salt = (provider or gen_salt)(8)
         return 'Salted__' + salt, salt
     return '', ''
 
@@ -75,70 +125,397 @@ def dec_header(cipher):
     return '', cipher
 
 
-def openssl_enc_bf_ecb(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_bf_ecb(text, salt, passphrase, 16)
+def openssl_enc_bf_ecb(passphrase, text, salted=True, salt=None,
+                       iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_bf_ecb(text, salt, passphrase, 16, iterations)
 
-def openssl_dec_bf_ecb(passphrase, cipher):
+def openssl_dec_bf_ecb(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_bf_ecb(c, salt, passphrase, 16)
+    return dec_bf_ecb(c, salt, passphrase, 16, iterations)
 
-def openssl_enc_bf_cbc(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_bf_cbc(text, salt, passphrase, 16)
+def openssl_enc_bf_cbc(passphrase, text, salted=True, salt=None,
+                       iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_bf_cbc(text, salt, passphrase, 16, iterations)
 
-def openssl_dec_bf_cbc(passphrase, cipher):
+def openssl_dec_bf_cbc(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_bf_cbc(c, salt, passphrase, 16)
+    return dec_bf_cbc(c, salt, passphrase, 16, iterations)
 
-def openssl_enc_aes_128_ecb(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_ecb(text, salt, passphrase, 16)
+def openssl_enc_aes_128_ecb(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_ecb(text, salt, passphrase, 16, iterations)
 
-def openssl_dec_aes_128_ecb(passphrase, cipher):
+def openssl_dec_aes_128_ecb(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_ecb(c, salt, passphrase, 16)
+    return dec_aes_ecb(c, salt, passphrase, 16, iterations)
 
-def openssl_enc_aes_192_ecb(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_ecb(text, salt, passphrase, 24)
+def openssl_enc_aes_192_ecb(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_ecb(text, salt, passphrase, 24, iterations)
 
-def openssl_dec_aes_192_ecb(passphrase, cipher):
+def openssl_dec_aes_192_ecb(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_ecb(c, salt, passphrase, 24)
+    return dec_aes_ecb(c, salt, passphrase, 24, iterations)
 
-def openssl_enc_aes_256_ecb(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_ecb(text, salt, passphrase, 32)
+def openssl_enc_aes_256_ecb(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_ecb(text, salt, passphrase, 32, iterations)
 
-def openssl_dec_aes_256_ecb(passphrase, cipher):
+def openssl_dec_aes_256_ecb(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_ecb(c, salt, passphrase, 32)
+    return dec_aes_ecb(c, salt, passphrase, 32, iterations)
 
-def openssl_enc_aes_128_cbc(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_cbc(text, salt, passphrase, 16)
+def openssl_enc_aes_128_cbc(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_cbc(text, salt, passphrase, 16, iterations)
 
-def openssl_dec_aes_128_cbc(passphrase, cipher):
+def openssl_dec_aes_128_cbc(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_cbc(c, salt, passphrase, 16)
+    return dec_aes_cbc(c, salt, passphrase, 16, iterations)
 
-def openssl_enc_aes_192_cbc(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_cbc(text, salt, passphrase, 24)
+def openssl_enc_aes_192_cbc(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_cbc(text, salt, passphrase, 24, iterations)
 
-def openssl_dec_aes_192_cbc(passphrase, cipher):
+def openssl_dec_aes_192_cbc(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_cbc(c, salt, passphrase, 24)
+    return dec_aes_cbc(c, salt, passphrase, 24, iterations)
 
-def openssl_enc_aes_256_cbc(passphrase, text, salted=True, salt=None):
-    header, salt = enc_header(salted, salt)
-    return header + enc_aes_cbc(text, salt, passphrase, 32)
+def openssl_enc_aes_256_cbc(passphrase, text, salted=True, salt=None,
+                            iterations=None, provider=None):
+    header, salt = enc_header(salted, salt, provider)
+    return header + enc_aes_cbc(text, salt, passphrase, 32, iterations)
 
-def openssl_dec_aes_256_cbc(passphrase, cipher):
+def openssl_dec_aes_256_cbc(passphrase, cipher, iterations=None):
     salt, c = dec_header(cipher)
-    return dec_aes_cbc(c, salt, passphrase, 32)
-
+    return dec_aes_cbc(c, salt, passphrase, 32, iterations)
+
+
+ECB = MODES['ecb']
+CBC = MODES['cbc']
+
+# name: (block cipher, block size, key length, (enc mode, dec mode))
+CIPHERS = {
+    'bf-ecb': (blowfish, 8, 16, ECB),
+    'bf-cbc': (blowfish, 8, 16, CBC),
+    'aes-128-ecb': (aes, 16, 16, ECB),
+    'aes-192-ecb': (aes, 16, 24, ECB),
+    'aes-256-ecb': (aes, 16, 32, ECB),
+    'aes-128-cbc': (aes, 16, 16, CBC),
+    'aes-192-cbc': (aes, 16, 24, CBC),
+    'aes-256-cbc': (aes, 16, 32, CBC)}
+
+def cipher_mode(cipher, passphrase, salt, decrypt, iterations=None):
+    '''Return (mode object, block size) for cipher name'''
+    if cipher not in CIPHERS:
+        raise ValueError('Unknown cipher %r' % cipher)
+    bc, bs, klen, modes = CIPHERS[cipher]
+    c, iv = cache.get(bc, bs, passphrase, salt, klen, iterations)
+    return modes[decrypt](c, iv), bs
+
+def cipher_context(cipher, passphrase, salt, decrypt, iterations=None):
+    '''Return update/finalize context for cipher name (see ska.context)'''
+    mode, bs = cipher_mode(cipher, passphrase, salt, decrypt, iterations)
+    return (enc_context, dec_context)[decrypt](mode, bs)
+
+
+class EncryptingWriter:
+
+    '''Write-only file-like object, encrypts to fileobj
+
+    Header is written at once, data are encrypted by chunk_size
+    bytes, padding is applied by close(). fileobj is not closed.
+    '''
+
+    def __init__(self, fileobj, passphrase, cipher='aes-256-cbc',
+                 salted=True, salt=None, chunk_size=1<<16,
+                 iterations=None, provider=None):
+        header, salt = enc_header(salted, salt, provider)
+        self.context = cipher_context(cipher, passphrase, salt, False, iterations)
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.npending = 0
+        self.closed = False
+        fileobj.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self.pending.append(data)
+        self.npending += len(data)
+        if self.npending >= self.chunk_size:
+            self.fileobj.write(self.context.update(''.join(self.pending)))
+            self.pending = []
+            self.npending = 0
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.fileobj.write(self.context.update(''.join(self.pending)) +
+                               self.context.finalize())
+            self.pending = []
+            self.flush()
+
+
+class DecryptingReader:
+
+    '''Read-only file-like object, decrypts data from fileobj
+
+    Ciphertext is read by chunk_size bytes. Last block is held
+    back until end of fileobj to strip padding.
+    '''
+
+    def __init__(self, fileobj, passphrase, cipher='aes-256-cbc',
+                 chunk_size=1<<16, iterations=None):
+        self.fileobj = fileobj
+        head = fileobj.read(16)
+        salt, raw = dec_header(head)
+        if len(head) < 16 and salt:
+            raise ValueError('Truncated header')
+        self.context = cipher_context(cipher, passphrase, salt, True, iterations)
+        self.text = self.context.update(raw)
+        self.pos = 0 # read offset in text
+        self.chunk_size = chunk_size
+        self.eof = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __fill(self):
+        data = self.fileobj.read(self.chunk_size)
+        if data:
+            data = self.context.update(data)
+        else:
+            self.eof = True
+            data = self.context.finalize()
+        self.text = self.text[self.pos:] + data # compact on refill only
+        self.pos = 0
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.text) - self.pos < size):
+            self.__fill()
+        pos = self.pos
+        if size < 0:
+            size = len(self.text) - pos
+        self.pos = min(pos + size, len(self.text))
+        return self.text[pos:self.pos]
+
+    def close(self):
+        self.eof = True
+        self.text = ''
+        self.pos = 0
+
+
+def openssl_decrypt_range(passphrase, source, offset, length, cipher='aes-256-cbc',
+                          iterations=None):
+    '''Decrypt plaintext bytes [offset, offset+length), see ska.seek'''
+    if cipher not in CIPHERS:
+        raise ValueError('Unknown cipher %r' % cipher)
+    bc, bs, klen, modes = CIPHERS[cipher]
+    salt, c = dec_header(read_at(source, 0, 16))
+    c, iv = cache.get(bc, bs, passphrase, salt, klen, iterations)
+    return decrypt_range(c, iv, source, offset, length, cipher[-3:],
+                         salt and 16 or 0)
+
+
+WINDOW = 1 << 20
+
+def map_input(f):
+    size = os.fstat(f.fileno()).st_size
+    if not size: # empty file can not be mapped
+        return ''
+    return mmap(f.fileno(), size, access=ACCESS_READ)
+
+def map_output(f, size):
+    f.truncate(size)
+    if not size:
+        return None
+    return mmap(f.fileno(), size, access=ACCESS_WRITE)
+
+def process_file(context, src, dst, head, skip, max_size, window):
+    '''Write head and result of context for src[skip:] to dst
+
+    dst is preallocated for max_size bytes and truncated to
+    actual size, which is returned. If context fails (bad decrypt),
+    dst is removed and the error is reraised.
+    '''
+    fi = open(src, 'rb')
+    try:
+        inp = map_input(fi)
+        try:
+            fo = open(dst, 'w+b')
+            out = None
+            try:
+                out = map_output(fo, max_size)
+                pos = 0
+                for s in xrange(skip, len(inp), window):
+                    r = head + context.update(inp[s:s+window])
+                    head = ''
+                    out[pos:pos+len(r)] = r
+                    pos += len(r)
+                r = head + context.finalize()
+                if r:
+                    out[pos:pos+len(r)] = r
+                    pos += len(r)
+            except:
+                if out is not None:
+                    out.close()
+                fo.close()
+                os.unlink(dst) # do not leave preallocated garbage
+                raise
+            if out is not None:
+                out.close()
+            fo.truncate(pos)
+            fo.close()
+        finally:
+            if inp:
+                inp.close()
+    finally:
+        fi.close()
+    return pos
+
+def openssl_enc_file(passphrase, src, dst, cipher='aes-256-cbc',
+                     salted=True, salt=None, window=WINDOW,
+                     iterations=None, provider=None):
+    '''Encrypt file src to file dst, return size of dst'''
+    header, salt = enc_header(salted, salt, provider)
+    context = cipher_context(cipher, passphrase, salt, False, iterations)
+    bs = context.bs
+    size = os.path.getsize(src)
+    return process_file(context, src, dst, header, 0,
+                        len(header) + size + bs - size % bs,
+                        window - window % bs or bs)
+
+def openssl_dec_file(passphrase, src, dst, cipher='aes-256-cbc', window=WINDOW,
+                     iterations=None):
+    '''Decrypt file src to file dst, return size of dst'''
+    f = open(src, 'rb')
+    head = f.read(16)
+    f.close()
+    salt, c = dec_header(head)
+    if len(head) < 16 and salt:
+        raise ValueError('Truncated header')
+    skip = salt and 16 or 0
+    context = cipher_context(cipher, passphrase, salt, True, iterations)
+    return process_file(context, src, dst, '', skip,
+                        os.path.getsize(src) - skip, window)
+
+
+def main(argv):
+    '''openssl enc compatible command line'''
+    decrypt = False
+    cipher = None
+    salted = True
+    passphrase = None
+    src = None
+    dst = None
+    iterations = None
+    args = iter(argv)
+    try:
+        for a in args:
+            if a == 'enc':
+                pass
+            elif a == '-e':
+                decrypt = False
+            elif a == '-d':
+                decrypt = True
+            elif a == '-salt':
+                salted = True
+            elif a == '-nosalt':
+                salted = False
+            elif a == '-pass':
+                p = args.next()
+                if not p.startswith('pass:'):
+                    raise ValueError('only pass:<passphrase> is supported')
+                passphrase = p[5:]
+            elif a == '-in':
+                src = args.next()
+            elif a == '-out':
+                dst = args.next()
+            elif a == '-pbkdf2':
+                iterations = iterations or PBKDF2_ITERATIONS
+            elif a == '-iter':
+                iterations = int(args.next())
+                if iterations < 1:
+                    raise ValueError('-iter must be positive')
+            elif a[1:] in CIPHERS:
+                cipher = a[1:]
+            else:
+                raise ValueError('unknown option %r' % a)
+        if cipher is None:
+            raise ValueError('cipher is not specified')
+        if passphrase is None:
+            raise ValueError('-pass is not specified')
+    except StopIteration:
+        return usage('option value is missing')
+    except ValueError, e:
+        return usage(str(e))
+    try:
+        return run(decrypt, cipher, salted, passphrase, src, dst, iterations)
+    except ValueError, e: # wrong passphrase or corrupted input
+        sys.stderr.write('bad decrypt\n%s\n' % e)
+        return 1
+    except IOError, e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+
+def run(decrypt, cipher, salted, passphrase, src, dst, iterations):
+    if src is not None and dst is not None:
+        if decrypt:
+            openssl_dec_file(passphrase, src, dst, cipher, iterations=iterations)
+        else:
+            openssl_enc_file(passphrase, src, dst, cipher, salted,
+                             iterations=iterations)
+        return 0
+    fi = src is None and sys.stdin or open(src, 'rb')
+    fo = dst is None and sys.stdout or open(dst, 'wb')
+    if decrypt:
+        r = DecryptingReader(fi, passphrase, cipher, iterations=iterations)
+        while True:
+            t = r.read(WINDOW)
+            if not t:
+                break
+            fo.write(t)
+    else:
+        w = EncryptingWriter(fo, passphrase, cipher, salted,
+                             iterations=iterations)
+        while True:
+            t = fi.read(WINDOW)
+            if not t:
+                break
+            w.write(t)
+        w.close()
+    fo.flush()
+    return 0
+
+def usage(error):
+    sys.stderr.write('error: %s\nusage: %s\n' %
+                     (error, __doc__[__doc__.index('python -m'):].rstrip()))
+    return 1
+
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    sys.exit(main(sys.argv[1:]))
 
 if __name__ == '__main__':
     from testutil import qrepr, ok, pad
@@ -181,6 +558,125 @@ if __name__ == '__main__':
               'enc:', test_enc, \
               'dec:', test_dec, \
               'rand_salt:', test_enc
+    # streaming
+    from StringIO import StringIO
+    text = 'Red leather, Yellow leather. ' * 20
+    for name in sorted(CIPHERS):
+        enc_op = globals()['openssl_enc_' + name.replace('-', '_')]
+        for salted in True, False:
+            ref_cipher = enc_op(passphrase, text, salted, 'saltsalt')
+            f = StringIO()
+            w = EncryptingWriter(f, passphrase, name, salted, 'saltsalt', chunk_size=40)
+            for i in xrange(0, len(text), 7):
+                w.write(text[i:i+7])
+            w.close()
+            test_enc = ok(f.getvalue() == ref_cipher)
+            r = DecryptingReader(StringIO(ref_cipher), passphrase, name, chunk_size=24)
+            t = ''
+            while True:
+                p = r.read(11)
+                if not p:
+                    break
+                t += p
+            r = DecryptingReader(StringIO(ref_cipher), passphrase, name) # one big chunk
+            p = [r.read(5), r.read(0), r.read(100)]
+            p.append(r.read())
+            test_dec = ok(t == text and ''.join(p) == text and p[1] == '' and r.read() == '')
+            print pad('stream %s %s' % (name, salted and '-salt' or '-nosalt'), 50), \
+                  'enc:', test_enc, \
+                  'dec:', test_dec
+            r = True
+            for offset, length in (0, 10), (100, 333), (len(text) - 5, 100):
+                if openssl_decrypt_range(passphrase, StringIO(ref_cipher), offset, length, name) != \
+                   text[offset:offset+length]:
+                    r = False
+            print pad('range %s %s' % (name, salted and '-salt' or '-nosalt'), 50), ok(r)
+    print pad('salt provider', 50), \
+          ok(enc_header(True, None, lambda n: 'x' * n) == ('Salted__xxxxxxxx', 'xxxxxxxx') and
+             len(enc_header(True, None)[1]) == 8 and enc_header(False, None) == ('', ''))
+    xs = lambda n: 'x' * n
+    out = StringIO()
+    w = EncryptingWriter(out, passphrase, 'bf-cbc', provider=xs)
+    w.close()
+    print pad('salt provider plumbing', 50), \
+          ok(openssl_enc_aes_128_ecb(passphrase, text, provider=xs)[:16] == 'Salted__xxxxxxxx' and
+             out.getvalue()[:16] == 'Salted__xxxxxxxx')
+    # PBKDF2: openssl enc -<cipher> -pbkdf2 -iter 1000 -S 0102030405060708
+    # (openssl 3 writes no Salted__ header if salt is given by -S)
+    from binascii import unhexlify
+    text = 'Red leather, Yellow leather.'
+    for name, enc_op, dec_op, ref_cipher in (
+        ('aes-256-cbc', openssl_enc_aes_256_cbc, openssl_dec_aes_256_cbc,
+         '3c243b62a65972b264f8e998892fbc9307cc0bd94acae360503bba57e3041a1b'),
+        ('aes-128-ecb', openssl_enc_aes_128_ecb, openssl_dec_aes_128_ecb,
+         '5bf7cda783784a878a97398cf6737a65a97fab23ddcd21bf5f024f30dae12341'),
+        ('bf-cbc', openssl_enc_bf_cbc, openssl_dec_bf_cbc,
+         'a77ffa5da9aa8e47fc502defd191eac5a4691083dee0879e89afa4366681b860')):
+        salt = unhexlify('0102030405060708')
+        ref_cipher = 'Salted__' + salt + unhexlify(ref_cipher)
+        e = enc_op(passphrase, text, True, salt, iterations=1000)
+        t = dec_op(passphrase, e, iterations=1000)
+        print pad('openssl -%s -pbkdf2 -iter 1000' % name, 50), \
+              'enc:', ok(e == ref_cipher), \
+              'dec:', ok(t == text)
+    # openssl enc -aes-128-cbc -pbkdf2 -nosalt (10000 iterations)
+    ref_cipher = unhexlify('861435cb2773ab2bcb4370eb9f91c7950c384cfe1148a8562921e01284fb00cb')
+    r = DecryptingReader(StringIO(ref_cipher), passphrase, 'aes-128-cbc',
+                         iterations=PBKDF2_ITERATIONS)
+    print pad('stream openssl -aes-128-cbc -pbkdf2 -nosalt', 50), ok(r.read() == text)
+    try:
+        openssl_enc_aes_128_cbc(passphrase, text, iterations=0)
+        r = False
+    except ValueError:
+        r = True
+    print pad('zero iterations rejected', 50), ok(r)
+    # files
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    tmp = mkdtemp()
+    try:
+        src = os.path.join(tmp, 'text')
+        enc = os.path.join(tmp, 'enc')
+        dec = os.path.join(tmp, 'dec')
+        for t in '', text, text * 100:
+            open(src, 'wb').write(t)
+            for name in 'bf-cbc', 'aes-128-ecb', 'aes-256-cbc':
+                enc_op = globals()['openssl_enc_' + name.replace('-', '_')]
+                for salted in True, False:
+                    openssl_enc_file(passphrase, src, enc, name, salted, 'saltsalt', window=40)
+                    test_enc = ok(open(enc, 'rb').read() == enc_op(passphrase, t, salted, 'saltsalt'))
+                    openssl_dec_file(passphrase, enc, dec, name, window=24)
+                    test_dec = ok(open(dec, 'rb').read() == t)
+                    print pad('file %d bytes %s %s' % (len(t), name, salted and '-salt' or '-nosalt'), 50), \
+                          'enc:', test_enc, \
+                          'dec:', test_dec
+        r = main(['enc', '-e', '-aes-192-cbc', '-pass', 'pass:' + passphrase,
+                  '-in', src, '-out', enc]) == 0
+        dec_in = open(enc, 'rb')
+        sys_stdout = sys.stdout
+        sys.stdout = dec_out = StringIO()
+        sys_stdin = sys.stdin
+        sys.stdin = dec_in
+        try:
+            r = r and main(['-d', '-aes-192-cbc', '-pass', 'pass:' + passphrase]) == 0
+        finally:
+            sys.stdout = sys_stdout
+            sys.stdin = sys_stdin
+            dec_in.close()
+        print pad('command line', 50), ok(r and dec_out.getvalue() == text * 100)
+        sys_stderr = sys.stderr
+        sys.stderr = err = StringIO()
+        try:
+            open(src, 'wb').write(open(enc, 'rb').read()[:-1]) # truncated
+            r = main(['-d', '-aes-192-cbc', '-pass', 'pass:' + passphrase,
+                      '-in', src, '-out', dec])
+        finally:
+            sys.stderr = sys_stderr
+        print pad('command line, bad decrypt', 50), \
+              ok(r == 1 and err.getvalue().startswith('bad decrypt\n') and
+                 not os.path.exists(dec))
+    finally:
+        rmtree(tmp)
     __how_to_preapre_test_vectors__=r'''
 #!/bin/sh
 
@@ -0,0 +1,295 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from multiprocessing import Pool, cpu_count
+from itertools import islice
+from collections import deque
+from mode import enc_ecb, dec_ecb, dec_cbc, enc_blocks, dec_blocks, xor_buffer
+from openssl import cipher_mode, enc_header, dec_header, CIPHERS, PADDING
+
+__all__ = 'parallel', 'encrypt_many', 'decrypt_many'
+
+__doc__ = '''Parallel encryption/decryption of large payloads
+
+ECB (both directions) and CBC decryption have independent
+blocks. Payload is split into block-aligned chunks, chunks are
+processed by pool of worker processes, results are joined
+in order. Workers get expanded key once, when pool is started.
+Payloads smaller than threshold are processed in-process.
+
+Example:
+from ska.parallel import parallel
+from ska.aes import aes
+p = parallel(aes(key), 16, workers=8)
+e = p.enc_ecb(text)
+d = p.dec_ecb(e)
+t = p.dec_cbc(iv, cbc_crypted)
+p.close()
+Without with-block (or close()) every large call starts and joins
+its own pool. Shortcuts use it given workers, e.g.
+ska.shortcuts.dec_aes_cbc(crypted, salt, passphrase, workers=8)
+
+encrypt_many and decrypt_many process many independent
+messages in OpenSSL-compat format (see ska.openssl). Messages
+are sent to workers by batches of batch_size, at most window
+batches are in flight, results are yielded in input order:
+for c in encrypt_many(records, 'passphrase', 'aes-256-cbc'):
+    out.write(c)
+'''
+
+CHUNK_SIZE = 1 << 20
+THRESHOLD = 1 << 21
+
+# worker side
+
+worker_cipher = None
+worker_block_size = None
+
+def worker_init(block_chifer, block_size):
+    global worker_cipher, worker_block_size
+    worker_cipher = block_chifer
+    worker_block_size = block_size
+
+def worker_enc(text):
+    return enc_blocks(worker_cipher, text, worker_block_size)
+
+def worker_dec(crypted):
+    return dec_blocks(worker_cipher, crypted, worker_block_size)
+
+def worker_dec_cbc(args):
+    crypted, c = args # c: previous crypted block or iv
+    return xor_buffer(dec_blocks(worker_cipher, crypted, worker_block_size),
+                      c + crypted[:-worker_block_size])
+
+worker_batch = None # (batch function, its args), set in pool workers only
+
+def worker_init_many(func, args):
+    global worker_batch
+    worker_batch = func, args
+
+def worker_many(batch):
+    func, args = worker_batch
+    return func(args, batch)
+
+def openssl_enc_one(passphrase, text, cipher, salted, provider):
+    header, salt = enc_header(salted, None, provider)
+    mode, bs = cipher_mode(cipher, passphrase, salt, False)
+    return header + mode(PADDING[bs][0](text))
+
+def openssl_dec_one(passphrase, crypted, cipher):
+    salt, c = dec_header(crypted)
+    mode, bs = cipher_mode(cipher, passphrase, salt, True)
+    return PADDING[bs][1](mode(c))
+
+def encrypt_batch(args, texts):
+    passphrase, cipher, salted, provider = args
+    return [openssl_enc_one(passphrase, t, cipher, salted, provider) for t in texts]
+
+def decrypt_batch(args, crypted):
+    passphrase, cipher, salted, provider = args
+    return [openssl_dec_one(passphrase, c, cipher) for c in crypted]
+
+
+def batches(items, batch_size):
+    items = iter(items)
+    while True:
+        b = list(islice(items, batch_size))
+        if not b:
+            return
+        yield b
+
+def run_many(func, items, args, workers, batch_size, window):
+    if args[1] not in CIPHERS: # check cipher name before first next()
+        raise ValueError('Unknown cipher %r' % args[1])
+    return results_many(func, items, args, workers, batch_size, window)
+
+def results_many(func, items, args, workers, batch_size, window):
+    workers = workers or cpu_count()
+    window = window or 2 * workers
+    if workers < 2: # args are bound to this call, not to module
+        for b in batches(items, batch_size):
+            for r in func(args, b):
+                yield r
+        return
+    pool = Pool(workers, worker_init_many, (func, args))
+    try:
+        pending = deque()
+        for b in batches(items, batch_size):
+            pending.append(pool.apply_async(worker_many, (b,)))
+            if len(pending) >= window:
+                for r in pending.popleft().get():
+                    yield r
+        while pending:
+            for r in pending.popleft().get():
+                yield r
+        pool.close()
+    finally:
+        pool.terminate() # no-op after close() and get() of all results
+        pool.join()
+
+def encrypt_many(messages, passphrase, cipher='aes-256-cbc', salted=True,
+                 workers=None, batch_size=64, window=None, provider=None):
+    '''Iterator over encrypted messages, order is preserved
+
+    provider is salt source (see ska.openssl.enc_header),
+    it has to be picklable if workers are used'''
+    return run_many(encrypt_batch, messages, (passphrase, cipher, salted, provider),
+                    workers, batch_size, window)
+
+def decrypt_many(messages, passphrase, cipher='aes-256-cbc',
+                 workers=None, batch_size=64, window=None):
+    '''Iterator over decrypted messages, order is preserved'''
+    return run_many(decrypt_batch, messages, (passphrase, cipher, None, None),
+                    workers, batch_size, window)
+
+
+class parallel:
+    '''Pool is kept between calls inside with-block only,
+    otherwise every large call starts and joins its own pool'''
+
+    def __init__(self, block_chifer, block_size, workers=None,
+                 chunk_size=CHUNK_SIZE, threshold=THRESHOLD):
+        self.bc = block_chifer
+        self.bs = block_size
+        self.workers = workers or cpu_count()
+        self.chunk_size = max(chunk_size - chunk_size % block_size, block_size)
+        self.threshold = threshold
+        self.pool = None
+        self.keep = False
+
+    def __enter__(self):
+        self.keep = True
+        return self
+
+    def __exit__(self, *exc):
+        self.keep = False
+        self.close()
+
+    def __map(self, func, args):
+        if self.pool is None: # started on first large payload
+            self.pool = Pool(self.workers, worker_init, (self.bc, self.bs))
+        try:
+            return ''.join(self.pool.imap(func, args))
+        finally:
+            if not self.keep:
+                self.close()
+
+    def __chunks(self, text):
+        for s in xrange(0, len(text), self.chunk_size):
+            yield text[s:s+self.chunk_size]
+
+    def enc_ecb(self, text): # len(text) % block_size == 0
+        if len(text) < self.threshold:
+            return enc_ecb(self.bc, self.bs)(text)
+        return self.__map(worker_enc, self.__chunks(text))
+
+    def dec_ecb(self, crypted):
+        if len(crypted) < self.threshold:
+            return dec_ecb(self.bc, self.bs)(crypted)
+        return self.__map(worker_dec, self.__chunks(crypted))
+
+    def dec_cbc(self, iv, crypted):
+        if len(crypted) < self.threshold:
+            return dec_cbc(self.bc, iv)(crypted)
+        cs = self.chunk_size
+        bs = self.bs
+        return self.__map(worker_dec_cbc,
+                          ((crypted[s:s+cs], s and crypted[s-bs:s] or iv)
+                           for s in xrange(0, len(crypted), cs)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+if __name__ == '__main__':
+    from time import time
+    from testutil import ok, pad
+    from aes import aes
+    from bf import blowfish
+    from mode import enc_cbc
+    text = ''.join(map(chr, range(256))) * 1024
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        iv = 'v' * bs
+        name = c.__class__.__name__
+        e = enc_ecb(c, bs)(text)
+        with parallel(c, bs, workers=4, chunk_size=10000, threshold=50000) as p:
+            print pad('%s ECB enc' % name, 50), ok(p.enc_ecb(text) == e)
+            print pad('%s ECB dec' % name, 50), ok(p.dec_ecb(e) == text)
+            print pad('%s CBC dec' % name, 50), ok(p.dec_cbc(iv, enc_cbc(c, iv)(text)) == text)
+            print pad('%s below threshold' % name, 50), ok(p.dec_ecb(e[:bs*8]) == text[:bs*8])
+            print pad('%s pool kept in with-block' % name, 50), ok(p.pool is not None)
+        print pad('%s pool released on exit' % name, 50), ok(p.pool is None)
+        p = parallel(c, bs, workers=2, chunk_size=10000, threshold=50000)
+        print pad('%s CBC dec, single call' % name, 50), \
+              ok(parallel(c, bs, workers=2, threshold=50000).dec_cbc(iv, enc_cbc(c, iv)(text)) == text)
+        print pad('%s pool released after call' % name, 50), \
+              ok(p.dec_ecb(e) == text and p.pool is None)
+    from openssl import openssl_dec_aes_256_cbc, openssl_dec_bf_cbc, openssl_dec_aes_128_ecb, \
+                        openssl_enc_bf_cbc
+    records = ['record %d ' % i * (i % 7) for i in range(100)]
+    for cipher, dec_op in ('aes-256-cbc', openssl_dec_aes_256_cbc), ('bf-cbc', openssl_dec_bf_cbc):
+        for workers in 1, 3:
+            e = list(encrypt_many(records, 'pass', cipher, workers=workers, batch_size=16, window=2))
+            print pad('encrypt_many %s workers=%d' % (cipher, workers), 50), \
+                  ok([dec_op('pass', c) for c in e] == records)
+            d = decrypt_many(iter(e), 'pass', cipher, workers=workers, batch_size=7)
+            print pad('decrypt_many %s workers=%d' % (cipher, workers), 50), \
+                  ok(list(d) == records)
+    for workers in 1, 2:
+        e1 = encrypt_many(records, 'p1', 'aes-128-cbc', workers=workers, batch_size=2)
+        e2 = encrypt_many(records, 'p2', 'bf-cbc', workers=workers, batch_size=3)
+        r1 = []
+        r2 = []
+        for a, b in zip(e1, e2): # interleaved generators
+            r1.append(a)
+            r2.append(b)
+        d1 = decrypt_many(r1, 'p1', 'aes-128-cbc', workers=workers, batch_size=4)
+        d2 = decrypt_many(r2, 'p2', 'bf-cbc', workers=workers, batch_size=5)
+        d = zip(d1, d2)
+        print pad('interleaved generators workers=%d' % workers, 50), \
+              ok([x[0] for x in d] == records and [x[1] for x in d] == records)
+    def fixed_salt(n):
+        return 's' * n
+    for workers in 1, 2:
+        e = list(encrypt_many(records[:10], 'pass', 'bf-cbc', workers=workers, provider=fixed_salt))
+        print pad('encrypt_many provider workers=%d' % workers, 50), \
+              ok(e[3] == openssl_enc_bf_cbc('pass', records[3], True, 'ssssssss') and
+                 [x[:16] for x in e] == ['Salted__ssssssss'] * 10)
+    e = encrypt_many(records, 'pass', 'aes-128-ecb', salted=False, workers=2, batch_size=5)
+    first = e.next()
+    e.close() # early exit terminates pool
+    print pad('encrypt_many early exit', 50), ok(openssl_dec_aes_128_ecb('pass', first) == records[0])
+    text = text * 8
+    p = parallel(aes('k' * 16), 16, threshold=0)
+    for name, op in ('in-process', enc_ecb(p.bc, 16)), ('parallel (%d workers)' % p.workers, p.enc_ecb):
+        t = time()
+        op(text)
+        t = time() - t
+        print 'AES ECB %d bytes, %s: %.2f s' % (len(text), name, t)
+    p.close()
@@ -0,0 +1,118 @@
+# Copyright 2011 Alexey V Michurin <a.michurin@gmail.com>. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice, this list of
+#       conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright notice, this list
+#       of conditions and the following disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY Alexey V Michurin ''AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL Alexey V Michurin OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those of the
+# authors and should not be interpreted as representing official policies, either expressed
+# or implied, of Alexey V Michurin.
+
+from mode import dec_ecb, dec_cbc
+from context import PADDING
+
+__all__ = 'decrypt_range',
+
+__doc__ = '''Random-access decryption of ECB and CBC ciphertexts
+
+Plaintext bytes [offset, offset+length) depend only on covering
+ciphertext blocks and (CBC) on one preceding ciphertext block,
+so they can be decrypted without processing whole ciphertext.
+
+source is a buffer (str, mmap, bytearray) or a file object
+(seek/tell/read). Ciphertext starts at data_offset of source
+(16 for OpenSSL Salted__ header, see
+ska.openssl.openssl_decrypt_range). If padding is set and range
+reaches the last block, padding is stripped, so range is clipped
+by the end of plaintext.
+
+Example:
+from ska.seek import decrypt_range
+from ska.aes import aes
+record = decrypt_range(aes(key), iv, open('archive', 'rb'), 10**9, 100)
+'''
+
+
+def source_size(source):
+    if hasattr(source, '__getitem__'):
+        return len(source)
+    source.seek(0, 2)
+    return source.tell()
+
+def read_at(source, offset, size):
+    if hasattr(source, '__getitem__'):
+        return str(source[offset:offset+size])
+    source.seek(offset)
+    return source.read(size)
+
+def decrypt_range(block_chifer, iv, source, offset, length, mode='cbc',
+                  data_offset=0, padding=True):
+    '''Decrypt plaintext bytes [offset, offset+length)'''
+    if mode not in ('ecb', 'cbc'):
+        raise ValueError('Unknown mode %r' % mode)
+    bs = len(iv)
+    size = source_size(source) - data_offset
+    if size % bs:
+        raise ValueError('Data are not block-aligned')
+    nblocks = size // bs
+    if length <= 0 or offset >= size:
+        return ''
+    first = offset // bs
+    last = min((offset + length - 1) // bs, nblocks - 1)
+    crypted = read_at(source, data_offset + first * bs, (last - first + 1) * bs)
+    if mode == 'ecb':
+        text = dec_ecb(block_chifer, bs)(crypted)
+    else:
+        if first:
+            iv = read_at(source, data_offset + (first - 1) * bs, bs)
+        text = dec_cbc(block_chifer, iv)(crypted)
+    if padding and last == nblocks - 1:
+        text = PADDING[bs][1](text)
+    s = offset - first * bs
+    return text[s:s+length]
+
+
+if __name__ == '__main__':
+    from testutil import ok, pad
+    from StringIO import StringIO
+    from tempfile import TemporaryFile
+    from mmap import mmap, ACCESS_READ
+    from aes import aes
+    from bf import blowfish
+    from mode import enc_ecb, enc_cbc
+    text = ''.join(map(chr, range(256))) * 3 + 'tail'
+    for c, bs in (aes('k' * 16), 16), (blowfish('k' * 56), 8):
+        iv = 'v' * bs
+        for mode, enc in ('ecb', lambda: enc_ecb(c, bs)), ('cbc', lambda: enc_cbc(c, iv)):
+            cryp = 'HEADER' + enc()(PADDING[bs][0](text))
+            f = TemporaryFile()
+            f.write(cryp)
+            f.flush()
+            m = mmap(f.fileno(), 0, access=ACCESS_READ)
+            for src_name, src in ('str', cryp), ('file', StringIO(cryp)), ('mmap', m):
+                r = True
+                for offset, length in ((0, 1), (0, 16), (5, 30), (bs, bs), (100, 200),
+                                       (len(text) - 10, 10), (len(text) - 3, 100),
+                                       (len(text) + 5, 10), (17, 0)):
+                    if decrypt_range(c, iv, src, offset, length, mode, 6) != \
+                       text[offset:offset+length]:
+                        r = False
+                print pad('%s %s %s' % (c.__class__.__name__, mode, src_name), 50), ok(r)
+            m.close()
+            f.close()
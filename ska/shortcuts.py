@@ -29,7 +29,7 @@ from bf import blowfish
 from aes import aes
 from mode import dec_ecb, enc_ecb, dec_cbc, enc_cbc, dec_pcbc, enc_pcbc
 from pad import pkcs5_pad, pkcs5_unpad, pkcs7_pad, pkcs7_unpad
-from key import passphrase_to_salted_key_and_iv
+from cache import cipher_cache
 
 
 __all__ = ('enc_bf_ecb', 'dec_bf_ecb',
@@ -39,57 +39,92 @@ __all__ = ('enc_bf_ecb', 'dec_bf_ecb',
            'enc_aes_cbc', 'dec_aes_cbc',
            'enc_aes_pcbc', 'dec_aes_pcbc')
 
-__doc__ = '''Convenience functions'''
+__doc__ = '''Convenience functions
 
+Derived keys and expanded key schedules are kept in LRU
+cache ska.shortcuts.cache (see ska.cache.cipher_cache):
+cache.resize(size, byte_budget) -- change limits
+cache.hits, cache.misses -- counters
+cache.invalidate(passphrase), cache.clear() -- drop entries
 
-def enc_bf_ecb(text, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 0)
-    return enc_ecb(blowfish(key), 8)(pkcs5_pad(text))
+iterations -- number of PBKDF2-HMAC-SHA256 iterations for key
+derivation, None (default) for OpenSSL EVP_BytesToKey (MD5).
 
-def dec_bf_ecb(crypted, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 0)
-    return pkcs5_unpad(dec_ecb(blowfish(key), 8)(crypted))
+workers -- number of worker processes for ECB (enc_*_ecb, dec_*_ecb)
+and CBC decryption (dec_*_cbc), see ska.parallel; payloads below
+ska.parallel.THRESHOLD bytes are processed in-process anyway.
+None (default) -- no workers.
+'''
 
-def enc_bf_cbc(text, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 8)
-    return enc_cbc(blowfish(key), iv)(pkcs5_pad(text))
+cache = cipher_cache()
 
-def dec_bf_cbc(crypted, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 8)
-    return pkcs5_unpad(dec_cbc(blowfish(key), iv)(crypted))
+def in_parallel(bc, bs, workers, method, *args):
+    # imported here: ska.parallel imports ska.openssl, which imports this module
+    from parallel import parallel
+    with parallel(bc, bs, workers) as p:
+        return getattr(p, method)(*args)
 
-def enc_bf_pcbc(text, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 8)
-    return enc_pcbc(blowfish(key), iv)(pkcs5_pad(text))
 
-def dec_bf_pcbc(crypted, salt, passphrase, keylen=56):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 8)
-    return pkcs5_unpad(dec_pcbc(blowfish(key), iv)(crypted))
+def enc_bf_ecb(text, salt, passphrase, keylen=56, iterations=None, workers=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    if workers:
+        return in_parallel(bc, 8, workers, 'enc_ecb', pkcs5_pad(text))
+    return enc_ecb(bc, 8)(pkcs5_pad(text))
 
+def dec_bf_ecb(crypted, salt, passphrase, keylen=56, iterations=None, workers=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    if workers:
+        return pkcs5_unpad(in_parallel(bc, 8, workers, 'dec_ecb', crypted))
+    return pkcs5_unpad(dec_ecb(bc, 8)(crypted))
 
-def enc_aes_ecb(text, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 0)
-    return enc_ecb(aes(key), 16)(pkcs7_pad(text))
+def enc_bf_cbc(text, salt, passphrase, keylen=56, iterations=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    return enc_cbc(bc, iv)(pkcs5_pad(text))
 
-def dec_aes_ecb(crypted, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 0)
-    return pkcs7_unpad(dec_ecb(aes(key), 16)(crypted))
+def dec_bf_cbc(crypted, salt, passphrase, keylen=56, iterations=None, workers=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    if workers:
+        return pkcs5_unpad(in_parallel(bc, 8, workers, 'dec_cbc', iv, crypted))
+    return pkcs5_unpad(dec_cbc(bc, iv)(crypted))
 
-def enc_aes_cbc(text, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 16)
-    return enc_cbc(aes(key), iv)(pkcs7_pad(text))
+def enc_bf_pcbc(text, salt, passphrase, keylen=56, iterations=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    return enc_pcbc(bc, iv)(pkcs5_pad(text))
 
-def dec_aes_cbc(crypted, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 16)
-    return pkcs7_unpad(dec_cbc(aes(key), iv)(crypted))
+def dec_bf_pcbc(crypted, salt, passphrase, keylen=56, iterations=None):
+    bc, iv = cache.get(blowfish, 8, passphrase, salt, keylen, iterations)
+    return pkcs5_unpad(dec_pcbc(bc, iv)(crypted))
 
-def enc_aes_pcbc(text, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 16)
-    return enc_pcbc(aes(key), iv)(pkcs7_pad(text))
 
-def dec_aes_pcbc(crypted, salt, passphrase, keylen=32):
-    key, iv = passphrase_to_salted_key_and_iv(passphrase, salt, keylen, 16)
-    return pkcs7_unpad(dec_pcbc(aes(key), iv)(crypted))
+def enc_aes_ecb(text, salt, passphrase, keylen=32, iterations=None, workers=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    if workers:
+        return in_parallel(bc, 16, workers, 'enc_ecb', pkcs7_pad(text))
+    return enc_ecb(bc, 16)(pkcs7_pad(text))
+
+def dec_aes_ecb(crypted, salt, passphrase, keylen=32, iterations=None, workers=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    if workers:
+        return pkcs7_unpad(in_parallel(bc, 16, workers, 'dec_ecb', crypted))
+    return pkcs7_unpad(dec_ecb(bc, 16)(crypted))
+
+def enc_aes_cbc(text, salt, passphrase, keylen=32, iterations=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    return enc_cbc(bc, iv)(pkcs7_pad(text))
+
+def dec_aes_cbc(crypted, salt, passphrase, keylen=32, iterations=None, workers=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    if workers:
+        return pkcs7_unpad(in_parallel(bc, 16, workers, 'dec_cbc', iv, crypted))
+    return pkcs7_unpad(dec_cbc(bc, iv)(crypted))
+
+def enc_aes_pcbc(text, salt, passphrase, keylen=32, iterations=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    return enc_pcbc(bc, iv)(pkcs7_pad(text))
+
+def dec_aes_pcbc(crypted, salt, passphrase, keylen=32, iterations=None):
+    bc, iv = cache.get(aes, 16, passphrase, salt, keylen, iterations)
+    return pkcs7_unpad(dec_pcbc(bc, iv)(crypted))
 
 
 if __name__ == '__main__':
@@ -170,3 +205,13 @@ if __name__ == '__main__':
         c = enc_op(text, salt, passphrase, klen)
         t = dec_op(c, salt, passphrase, klen)
         print pad(rem, 50), 'enc:', ok(c == ref_cryp), 'dec:', ok(t == text)
+    print pad('cipher cache', 50), ok(cache.hits > 0 and len(cache) > 0)
+    from parallel import THRESHOLD
+    big = text * (THRESHOLD // len(text) + 1)
+    c = enc_aes_ecb(big, 'saltsalt', passphrase, workers=2)
+    print pad('ECB enc/dec workers=2', 50), \
+          ok(c == enc_aes_ecb(big, 'saltsalt', passphrase) and
+             dec_aes_ecb(c, 'saltsalt', passphrase, workers=2) == big)
+    c = enc_bf_cbc(big, 'saltsalt', passphrase)
+    print pad('CBC dec workers=2', 50), \
+          ok(dec_bf_cbc(c, 'saltsalt', passphrase, workers=2) == big)